@@ -1,24 +1,31 @@
 import threading
 import os
 import datetime
+import json
+import time
 
 from twisted.web import http
 from twisted.web.http import HTTPChannel
-from twisted.internet import reactor, defer
+from twisted.internet import reactor, defer, threads
 
 from urlparse import urlparse, parse_qs
 
+from broadcast import MjpegBroadcaster, BOUNDARY
+from downloads import send_file
+from thumbnails import KINDS
+from replay import ReplayStream, mjpeg_avi
+from notifications import NotificationChannel
+from commandbus import CommandBus
+import settings
+
 
 class RecorderHandler(http.Request, object):
-    BOUNDARY = "jpgboundary"
+    BOUNDARY = BOUNDARY
 
     def __init__(self, api, *args, **kwargs):
         self.api = api
         super(RecorderHandler, self).__init__(*args, **kwargs)
 
-    def get_frame(self):
-        return self.api.recorder.current_jpg_frame
-
     def wait(self, seconds, result=None):
         """Returns a deferred that will be fired later"""
         d = defer.Deferred()
@@ -34,40 +41,60 @@ class RecorderHandler(http.Request, object):
     def not_found(self, message=None):
         self.setResponseCode(404, message)
         self.setHeader("Content-Type", "image/gif")
-        f = open("404.gif", "r")
-        content = f.read()
-        self.write(content)
+        self.write(self.api.static_file("404.gif"))
         self.finish()
 
+    def bad_request(self, message):
+        self.setResponseCode(400)
+        self.simple_render(message)
+
     def simple_render(self, content, content_type="text/plain"):
         self.render(content, [("Content-Type", content_type)])
 
+    def render_reply(self, content):
+        """ simple_render for answers that take a while, the client may have disconnected by then """
+        if not self._disconnected:
+            self.simple_render(content)
+
     def render(self, content, headers):
         for (header_name, header_value) in headers:
             self.setHeader(header_name, header_value)
         self.write(content)
         self.finish()
 
-    @defer.inlineCallbacks
     def serve_stream(self):
-        """ Serve video stream as multi-part jpg. Yes, this actually works. """
-        boundary = "jpgboundary"
-
+        """ Serve video stream as multi-part jpg. Yes, this actually works. The broadcaster pushes every new frame. """
+        self.setHeader('Connection', 'Keep-Alive')
+        self.setHeader('Content-Type', "multipart/x-mixed-replace;boundary=%s" % self.BOUNDARY)
+        self.api.broadcaster.subscribe(self)
+
+    def serve_replay(self):
+        """ Multi-part jpg stream of the replay buffer, starting seconds_ago back and staying that far behind live """
+        if self.api.video_locked:
+            return self.render(self.api.static_file("shoo.gif"), [("Content-Type", "image/gif")])
+        seconds_ago = float(self.args['seconds_ago'][0]) if 'seconds_ago' in self.args else 10
         self.setHeader('Connection', 'Keep-Alive')
-        self.setHeader('Content-Type', "multipart/x-mixed-replace;boundary=%s" % boundary)
-
-        while True:
-            if self.api.video_locked: 
-                self.write("Content-Type image/gif\n")
-                f = open("shoo.gif", "r")
-                content = f.read()
-            else:
-                content = self.get_frame()
-                self.write("Content-Type: image/jpg\n")
-            self.write("Content-Length: %s\n\n" % (len(content)))
-            self.write(content)
-            self.write("--%s\n" % (boundary))
-            yield self.wait(3 if self.api.video_locked else 0.05)
+        self.setHeader('Content-Type', "multipart/x-mixed-replace;boundary=%s" % self.BOUNDARY)
+        ReplayStream(self, self.api.recorder.frames, seconds_ago).start()
+
+    def serve_clip(self):
+        """ The last few seconds of the replay buffer as an mjpeg avi, put together in memory on another thread """
+        if self.api.video_locked:
+            return self.render(self.api.static_file("shoo.gif"), [("Content-Type", "image/gif")])
+        seconds = float(self.args['seconds'][0]) if 'seconds' in self.args else 10
+        snapshot = self.api.recorder.get_ordered_buffer(time.time() - seconds)
+
+        def make_clip():
+            frames = snapshot.sample(len(snapshot))
+            return mjpeg_avi(frames) if frames else None
+
+        d = threads.deferToThread(make_clip)
+        d.addCallback(lambda content: self.render(content, [
+            ("Content-Type", "video/x-msvideo"),
+            ("Content-Disposition", 'attachment; filename="clip.avi"'),
+        ]) if content else self.not_found())
+        d.addErrback(lambda failure: self.simple_render(failure.getErrorMessage()))
+        return d
 
     def serve_stream_container(self):
         headers = [("content-type", "text/html")]
@@ -75,24 +102,104 @@ class RecorderHandler(http.Request, object):
 	self.render(content, headers)
 
     def serve_frame(self):
-        return self.simple_render(self.get_frame(), "image/jpg")
+        """ The newest frame, optionally scaled down to ?width=. Answers 304 if the client already has it. """
+        try:
+            width = int(self.args['width'][0]) if 'width' in self.args else None
+        except ValueError:
+            width = 0
+        if width is not None and width <= 0:
+            return self.bad_request("width must be a positive number")
+
+        current_frame = self.api.recorder.current_frame
+        frame = current_frame.cached(width) if width else current_frame.get()
+        if frame is None and width:
+            # Not resized for this frame yet, which takes too long for the reactor thread
+            d = threads.deferToThread(current_frame.get, width)
+            d.addCallback(self.send_frame)
+            return d
+        self.send_frame(frame)
+
+    def send_frame(self, frame):
+        if self._disconnected:
+            return
+        if not frame:
+            return self.not_found()
+        (etag, content) = frame
+        if self.setETag(etag) == http.CACHED:
+            return self.finish()
+        self.render(content, [("Content-Type", "image/jpg"), ("Cache-Control", "no-cache")])
 
     def serve_latest_video(self):
+        recording = self.api.recorder.catalog.latest()
+        if not recording:
+            return self.not_found()
+        return self.serve_recording(recording)
 
-        candidates = os.listdir(".")
-        candidates = sorted([x for x in candidates if x.startswith("pool-")])
-        if not candidates:
+    def serve_recording(self, recording):
+        path = self.api.recorder.catalog.path(recording['file_name'])
+        if not os.path.exists(path):
             return self.not_found()
+        send_file(self, path, download_name=recording['file_name'])
 
-        file_name = candidates[-1]
-        f = open(file_name)
-        content = f.read()
+    def serve_thumbnail(self, recording, kind):
+        content = self.api.recorder.thumbnails.get(recording['file_name'], kind) if kind in KINDS else None
+        if not content:
+            return self.not_found()
+        # Thumbnails never change once a recording is saved
+        self.render(content, [("Content-Type", "image/jpeg"), ("Cache-Control", "public, max-age=86400")])
+
+    def serve_videos(self, args):
+        """ /videos lists the recordings a page at a time, newest first, /videos/<id> downloads one,
+            /videos/<id>/poster and /videos/<id>/strip are its thumbnails
+        """
+        catalog = self.api.recorder.catalog
+        if args:
+            recording = catalog.get(int(args[0]))
+            if not recording:
+                return self.not_found()
+            if len(args) > 1:
+                return self.serve_thumbnail(recording, args[1])
+            return self.serve_recording(recording)
+
+        page = int(self.args['page'][0]) if 'page' in self.args else 0
+        per_page = int(self.args['per_page'][0]) if 'per_page' in self.args else settings.VIDEOS_PER_PAGE
+        (recordings, total) = catalog.page(page, per_page)
+        listing = {'page': page, 'per_page': per_page, 'total': total, 'videos': recordings}
+        return self.simple_render(json.dumps(listing), "application/json")
+
+    def serve_status(self):
+        recorder = self.api.recorder
+        status = {
+            'fps': recorder.frame_rate,
+            'analysis': recorder.analysis_cadence.stats(),
+            'stages': [stage.stats() for stage in recorder.stages],
+            'stream_clients': self.api.broadcaster.stats(),
+        }
+        return self.simple_render(json.dumps(status), "application/json")
+
+    def serve_event_summary(self):
+        """ Number of motion events and seconds of motion between two unix timestamps, the last day by default """
+        end = float(self.args['to'][0]) if 'to' in self.args else time.time()
+        start = float(self.args['from'][0]) if 'from' in self.args else end - 24*60*60
+        summary = self.api.recorder.motion_detector.motion_events.summary(start, end)
+        return self.simple_render(json.dumps(summary), "application/json")
+
+    def send_save(self):
+        """ Ask the recorder to save, and answer once the video is saved """
+        seconds = int(self.args['seconds'][0]) if 'seconds' in self.args else None
+        shots = int(self.args['shots'][0]) if 'shots' in self.args else None
+        d = self.api.commands.send("save", seconds=seconds, shots=shots)
+        d.addCallbacks(lambda file_name: self.render_reply("Saved %s" % file_name),
+                       lambda failure: self.render_reply("Saving failed: %s" % failure.getErrorMessage()))
+        return d
 
-        headers = [
-            ("content-type", "application/octet-stream"),
-            ('content-disposition', 'attachment; filename="%s"' % file_name)
-        ]
-        self.render(content, headers)
+    def serve_notifications(self):
+        """ Motion, save, lock and frame rate changes as server-sent events, or long polled with ?since=<id> """
+        notifications = self.api.notifications
+        if 'since' in self.args:
+            return notifications.poll(self, int(self.args['since'][0]))
+        last_id = self.getHeader("last-event-id")
+        notifications.subscribe(self, int(last_id) if last_id else None)
 
     def process(self):
         command_args_list = [x for x in self.path.split("/") if x]
@@ -104,23 +211,36 @@ class RecorderHandler(http.Request, object):
 
         try:
             if command == "save":
-                self.api.trigger("save")
-                return self.simple_render("Saving video.")
+                return self.send_save()
+            elif command == "shots":
+                return self.simple_render(json.dumps(self.api.recorder.shot_detector.index()), "application/json")
             elif command == "quit":
-                self.api.trigger("quit")
-                return self.simple_render("Quitting.")
+                # Answered first, the recorder may be gone before the reply would come back
+                self.simple_render("Quitting.")
+                self.api.commands.send("quit")
+                return
             elif command.startswith("current"):
                 return self.serve_frame()
             elif command.startswith("latest_video"):
                 return self.serve_latest_video()
             elif command.startswith("stream"):
                 return self.serve_stream()
+            elif command == "replay":
+                return self.serve_replay()
+            elif command == "clip":
+                return self.serve_clip()
             elif command.startswith("show_stream"):
                 return self.serve_stream_container()
             elif command == "echo":
                 return self.simple_render(args[0])
+            elif command == "status":
+                return self.serve_status()
+            elif command == "events":
+                return self.serve_event_summary()
+            elif command == "notifications":
+                return self.serve_notifications()
             elif command == "videos":
-                pass
+                return self.serve_videos(args)
             elif command == "lock":
                 self.lock_video()
                 return self.simple_render("locked")
@@ -130,6 +250,8 @@ class RecorderHandler(http.Request, object):
                 else:
                     return self.simple_render("Wrong password.")
             elif command == "active":
+                if args and args[0] == "zones":
+                    return self.simple_render(json.dumps(self.api.recorder.motion_detector.zone_activity()), "application/json")
                 if self.api.recorder.motion_detector.recent_motion():
                     return self.simple_render("true")
                 else:
@@ -145,6 +267,8 @@ class RecorderHandler(http.Request, object):
         self.api.video_locked = True
         self.api.unlock_at = datetime.datetime.now() + datetime.timedelta(seconds=seconds) if seconds else None
         self.api.lock_password = password
+        self.api.broadcaster.publish(self.api.static_file("shoo.gif"), "image/gif")
+        self.api.notifications.publish("lock", {'locked': True, 'unlock_at': time.mktime(self.api.unlock_at.timetuple()) if self.api.unlock_at else None})
         if seconds:
             d = defer.Deferred()
             reactor.callLater(seconds, self.unlock_video, None)
@@ -154,6 +278,7 @@ class RecorderHandler(http.Request, object):
         password = self.args['password'][0] if 'password' in self.args else None
         if not self.api.lock_password or password == self.api.lock_password:
             self.api.video_locked = False
+            self.api.notifications.publish("lock", {'locked': False, 'unlock_at': None})
             return True
         return False
 
@@ -179,15 +304,23 @@ class Api:
         HTTPChannel.requestFactory = RecorderHandlerFactory(api=self)
 
         self.recorder = recorder
-        self.events = []
+        self.commands = CommandBus()
         self.video_locked = False
         self.lock_password = None
         self.unlock_at = None
+        self.broadcaster = MjpegBroadcaster()
+        self.notifications = NotificationChannel()
+        # Small files like the 404 gif, read once
+        self.static_files = {}
 
         reactor.listenTCP(8080, StreamFactory())
-        t = threading.Thread(target=reactor.run)
-        t.daemon = True
-        t.start()
-
-    def trigger(self, event):
-        self.events.append(event)
+        # Signal handlers can only be installed from the main thread
+        self.thread = threading.Thread(target=reactor.run, kwargs={'installSignalHandlers': False})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def static_file(self, file_name):
+        if file_name not in self.static_files:
+            with open(file_name, "rb") as f:
+                self.static_files[file_name] = f.read()
+        return self.static_files[file_name]
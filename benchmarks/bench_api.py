@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+""" Load test for the api: how many /stream viewers and /current pollers can be served before capture slows down.
+
+    Runs the real Api against a synthetic recorder that generates frames (no camera, serial port or kinect) and
+    encodes them like the recorder does. A separate process opens the stream clients, some of which read slowly
+    on purpose, and the pollers. Prints one json object with throughput, per client frame rates, reactor latency
+    and the recorder's frame rate, so runs can be compared across commits.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import numpy
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.internet import reactor, task, threads
+
+from api import Api
+from broadcast import BOUNDARY
+from currentframe import CurrentFrame
+from encoder import EncoderPool
+from ringbuffer import FrameRingBuffer
+import settings
+
+PORT = 8080
+# Seconds before a slow stream client has filled its socket buffers and the server starts skipping its frames
+MIN_SLOW_DURATION = 10
+
+
+class SyntheticRecorder(object):
+    """ Just enough of a recorder for the api: generated frames go through the encoder pool into the buffer,
+        the current frame and the stream broadcaster.
+    """
+
+    def __init__(self, fps, width, height):
+        self.fps = fps
+        self.size = (width, height)
+        self.frames = FrameRingBuffer(settings.BUFFER_LENGTH)
+        self.current_frame = CurrentFrame()
+        self.encoder = EncoderPool(self.store_jpg_frame)
+        self.frame_rate = 0
+        self.captured = 0
+        self.stages = []
+        self.keep_running = True
+        self.api = Api(self)
+
+    def store_jpg_frame(self, jpg_frames, timestamp):
+        self.frames.append(jpg_frames['archive'], timestamp)
+        preview_frame = jpg_frames.get('preview', jpg_frames['archive']).tostring()
+        self.current_frame.update(preview_frame)
+        self.api.broadcaster.publish(preview_frame, timestamp=timestamp)
+
+    def run(self):
+        (width, height) = self.size
+        random = numpy.random.RandomState(0)
+        background = random.randint(40, 80, (height, width, 3)).astype(numpy.uint8)
+        interval = 1.0 / self.fps
+        next_frame = time.time()
+        while self.keep_running:
+            frame = background.copy()
+            cv2.circle(frame, (self.captured * 5 % width, height / 2), 15, (255, 255, 255), -1)
+            self.encoder.submit(frame, copy=False)
+            self.captured += 1
+
+            next_frame += interval
+            delay = next_frame - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind, don't try to catch up
+                next_frame = time.time()
+
+
+class ReactorLatency(object):
+    """ How late a timer that should fire every interval seconds actually fires, measured on the reactor thread """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.delays = []
+        self.last = None
+        self.loop = task.LoopingCall(self.tick)
+
+    def tick(self):
+        now = time.time()
+        if self.last is not None:
+            self.delays.append(max(0.0, now - self.last - self.interval))
+        self.last = now
+
+    def start(self):
+        reactor.callFromThread(self.loop.start, self.interval)
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = numpy.array(values) * 1000
+    return {'mean_ms': values.mean(), 'p50_ms': numpy.percentile(values, 50), 'p95_ms': numpy.percentile(values, 95),
+            'max_ms': values.max()}
+
+
+def connect(path, receive_buffer=None):
+    connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if receive_buffer:
+        # Loopback buffers are big enough to hide a slow reader from the server for a long time, a slow
+        # link wouldn't be
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    connection.settimeout(10)
+    connection.connect(("127.0.0.1", PORT))
+    connection.sendall("GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n" % path)
+    return connection
+
+
+def stream_client(duration, slow, results):
+    """ Counts the frames of a /stream. Slow clients read a little at a time and sleep in between. """
+    connection = connect("/stream", 8192 if slow else None)
+    marker = "--%s\n" % BOUNDARY
+    (frames, received, tail) = (0, 0, "")
+    ended = time.time() + duration
+    while time.time() < ended:
+        try:
+            data = connection.recv(1024 if slow else 65536)
+        except socket.timeout:
+            break
+        if not data:
+            break
+        received += len(data)
+        tail += data
+        frames += tail.count(marker)
+        tail = tail[-len(marker):]
+        if slow:
+            time.sleep(0.1)
+    connection.close()
+    results.append({'slow': slow, 'frames': frames, 'bytes': received, 'fps': frames / duration})
+
+
+def read_response(connection):
+    """ Status code and body of a response with a content length """
+    data = ""
+    while "\r\n\r\n" not in data:
+        chunk = connection.recv(65536)
+        if not chunk:
+            raise IOError("Connection closed")
+        data += chunk
+    (head, body) = data.split("\r\n\r\n", 1)
+    lines = head.split("\r\n")
+    headers = dict(line.lower().split(": ", 1) for line in lines[1:])
+    length = int(headers.get("content-length", 0))
+    while len(body) < length:
+        body += connection.recv(65536)
+    return (int(lines[0].split()[1]), headers.get("etag"))
+
+
+def poller(duration, interval, results):
+    """ Polls /current with If-None-Match like a dashboard would, timing every request """
+    (etag, codes, latencies) = (None, {}, [])
+    ended = time.time() + duration
+    while time.time() < ended:
+        started = time.time()
+        connection = socket.create_connection(("127.0.0.1", PORT), timeout=10)
+        connection.sendall("GET /current HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n%s\r\n" %
+                           ("If-None-Match: %s\r\n" % etag if etag else ""))
+        (code, new_etag) = read_response(connection)
+        connection.close()
+        latencies.append(time.time() - started)
+        codes[code] = codes.get(code, 0) + 1
+        etag = new_etag or etag
+        time.sleep(max(0, interval - (time.time() - started)))
+    results.append({'codes': codes, 'latencies': latencies})
+
+
+def run_clients(options, queue):
+    """ Runs in its own process, so the clients don't compete with the server for the GIL """
+    (streams, polls) = ([], [])
+    threads = [threading.Thread(target=stream_client, args=(options.duration, False, streams)) for i in range(options.streams)]
+    threads += [threading.Thread(target=stream_client, args=(options.duration, True, streams)) for i in range(options.slow_streams)]
+    threads += [threading.Thread(target=poller, args=(options.duration, options.poll_interval, polls)) for i in range(options.pollers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    queue.put((streams, polls))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--streams", type=int, default=10, help="/stream clients reading as fast as they can")
+    parser.add_argument("--slow-streams", type=int, default=2, help="/stream clients reading slowly")
+    parser.add_argument("--pollers", type=int, default=10, help="/current pollers")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=20.0,
+                        help="Seconds, at least %s with slow streams so their buffers fill up and frames get skipped" % MIN_SLOW_DURATION)
+    parser.add_argument("--fps", type=float, default=30.0, help="Frame rate the synthetic recorder aims for")
+    parser.add_argument("--size", default="640x480", help="Frame size of the synthetic recorder")
+    parser.add_argument("--output", help="Also write the results to this file")
+    options = parser.parse_args()
+    if options.slow_streams and options.duration < MIN_SLOW_DURATION:
+        parser.error("--duration must be at least %s seconds with slow streams, until then their frames are only "
+                     "piling up in socket buffers and the server doesn't see them as slow" % MIN_SLOW_DURATION)
+
+    (width, height) = [int(x) for x in options.size.split("x")]
+    recorder = SyntheticRecorder(options.fps, width, height)
+    capture = threading.Thread(target=recorder.run)
+    capture.daemon = True
+    capture.start()
+    latency = ReactorLatency()
+    latency.start()
+    # Let the buffer and encoder warm up
+    time.sleep(1)
+
+    queue = multiprocessing.Queue()
+    clients = multiprocessing.Process(target=run_clients, args=(options, queue))
+    captured = recorder.captured
+    started = time.time()
+    clients.start()
+    # What the server thinks of its stream clients, shortly before they disconnect
+    time.sleep(options.duration * 0.9)
+    server_clients = threads.blockingCallFromThread(reactor, recorder.api.broadcaster.stats)
+    (streams, polls) = queue.get()
+    clients.join()
+    elapsed = time.time() - started
+    recorder_fps = (recorder.captured - captured) / elapsed
+    recorder.keep_running = False
+
+    fast_fps = [stream['fps'] for stream in streams if not stream['slow']]
+    slow_fps = [stream['fps'] for stream in streams if stream['slow']]
+    codes = {}
+    for poll in polls:
+        for (code, count) in poll['codes'].items():
+            codes[str(code)] = codes.get(str(code), 0) + count
+    results = {
+        'revision': git_revision(),
+        'options': vars(options),
+        'recorder': {'target_fps': options.fps, 'fps': recorder_fps, 'encoder_dropped': recorder.encoder.dropped_frames},
+        'streams': {
+            'clients': len(fast_fps),
+            'fps_mean': numpy.mean(fast_fps) if fast_fps else None,
+            'fps_min': min(fast_fps) if fast_fps else None,
+            'megabytes_per_second': sum(stream['bytes'] for stream in streams) / elapsed / 1e6,
+            'per_client_fps': fast_fps,
+        },
+        'slow_streams': {'clients': len(slow_fps), 'fps_mean': numpy.mean(slow_fps) if slow_fps else None, 'per_client_fps': slow_fps},
+        'pollers': {
+            'clients': len(polls),
+            'requests_per_second': sum(sum(poll['codes'].values()) for poll in polls) / elapsed,
+            'status_codes': codes,
+            'latency': percentiles([x for poll in polls for x in poll['latencies']]),
+        },
+        'reactor_latency': percentiles(latency.delays),
+        'server_stream_clients': [dict((key, client[key]) for key in ('frames_sent', 'frames_skipped', 'lag')) for client in server_clients],
+    }
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print output
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+    reactor.callFromThread(reactor.stop)
+    recorder.api.thread.join(5)
+
+
+if __name__ == "__main__":
+    main()
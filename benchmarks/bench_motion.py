@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+""" Compares the cv2 motion detector on scaled down frames with the old full resolution cv one.
+
+    Feeds both the same synthetic 640x480 frames (noisy background, a ball rolling across every now and then)
+    and prints the time per frame for each and how often they agree on whether there is motion.
+"""
+import os
+import sys
+import time
+import numpy
+import cv
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from motion import MotionDetector, LegacyMotionDetector
+
+
+def synthetic_frames(count, width=640, height=480, seed=0):
+    random = numpy.random.RandomState(seed)
+    background = random.randint(40, 80, (height, width, 3)).astype(numpy.uint8)
+    for i in range(count):
+        frame = background.copy()
+        noise = random.randint(0, 2, (height, width, 3)).astype(numpy.uint8)
+        cv2.add(frame, noise, frame)
+        # A ball rolls across for 30 frames out of every 100
+        if i % 100 < 30:
+            x = int((i % 100) / 30.0 * width)
+            cv2.circle(frame, (x, height / 2), 15, (255, 255, 255), -1)
+        yield frame
+
+
+def run(detector, frames, to_input):
+    motion = []
+    timings = []
+    for frame in frames:
+        frame_input = to_input(frame)
+        started = time.time()
+        detector.update(frame_input)
+        timings.append(time.time() - started)
+        motion.append(detector.motion_avg is not None and detector.motion_avg > detector.threshold)
+    return (numpy.array(timings[1:]), motion)
+
+
+def main(count=500):
+    frames = list(synthetic_frames(count))
+    # Synthetic motion events stay in memory, out of the recorder's event database
+    detector = MotionDetector(event_db=None)
+    (new_timings, new_motion) = run(detector, frames, lambda frame: frame)
+    (old_timings, old_motion) = run(LegacyMotionDetector(event_db=None), frames, lambda frame: cv.GetImage(cv.fromarray(frame)))
+
+    agreement = numpy.mean(numpy.array(new_motion) == numpy.array(old_motion))
+    print "frames: %s" % count
+    print "legacy cv, 640x480 colour: %.2f ms/frame (p95 %.2f ms)" % (old_timings.mean() * 1000, numpy.percentile(old_timings, 95) * 1000)
+    print "cv2, %sx%s grayscale: %.2f ms/frame (p95 %.2f ms)" % (detector.analysis_size + (new_timings.mean() * 1000, numpy.percentile(new_timings, 95) * 1000))
+    print "speedup: %.1fx" % (old_timings.mean() / new_timings.mean())
+    print "motion agreement: %.1f%%" % (agreement * 100)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
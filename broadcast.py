@@ -0,0 +1,113 @@
+import socket
+import time
+
+from zope.interface import implementer
+from twisted.internet import reactor
+from twisted.internet.interfaces import IPushProducer
+
+import settings
+
+BOUNDARY = "jpgboundary"
+
+
+def multipart(content, content_type):
+    return "Content-Type: %s\nContent-Length: %s\n\n%s--%s\n" % (content_type, len(content), content, BOUNDARY)
+
+
+@implementer(IPushProducer)
+class StreamClient(object):
+    """ One viewer of the stream. Twisted pauses it while the connection's write buffer is full, and while it's
+        paused only the newest frame is kept to be written when it resumes, so slow clients skip frames.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.paused = False
+        self.pending = None
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.last_sent_timestamp = None
+
+    def offer(self, part, timestamp):
+        if self.paused:
+            if self.pending:
+                self.frames_skipped += 1
+            self.pending = (part, timestamp)
+        else:
+            self.send(part, timestamp)
+
+    def send(self, part, timestamp):
+        self.request.write(part)
+        self.frames_sent += 1
+        self.last_sent_timestamp = timestamp
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        if self.pending:
+            (part, timestamp) = self.pending
+            self.pending = None
+            self.send(part, timestamp)
+
+    def stopProducing(self):
+        self.paused = True
+        self.pending = None
+
+
+class MjpegBroadcaster(object):
+    """ Pushes every new frame to all stream viewers, instead of each viewer polling for frames.
+
+        Frames are published from the capture side and written on the reactor thread. Every frame is turned into
+        its multipart chunk once and the same bytes go to every client.
+    """
+
+    def __init__(self):
+        # Only touched on the reactor thread
+        self.clients = []
+        # (multipart chunk, timestamp) of the newest frame, for new clients
+        self.latest = None
+
+    def publish(self, content, content_type="image/jpg", timestamp=None):
+        """ Thread safe, called whenever there's a new frame """
+        latest = self.latest = (multipart(content, content_type), timestamp if timestamp is not None else time.time())
+        if self.clients:
+            reactor.callFromThread(self.fan_out, *latest)
+
+    def fan_out(self, part, timestamp):
+        for client in list(self.clients):
+            client.offer(part, timestamp)
+
+    def subscribe(self, request):
+        if request.transport is not None:
+            # Otherwise the kernel buffers a lot of frames for a slow client before twisted notices it's backed up
+            request.transport.getHandle().setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, settings.STREAM_SEND_BUFFER)
+        client = StreamClient(request)
+        request.registerProducer(client, True)
+        request.notifyFinish().addBoth(lambda result: self.unsubscribe(client))
+        self.clients.append(client)
+        if self.latest:
+            client.offer(*self.latest)
+        return client
+
+    def unsubscribe(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+        client.stopProducing()
+
+    def stats(self):
+        """ Per client frames sent and skipped, and how many seconds the last frame written to it is behind the newest.
+
+            Written isn't received: up to STREAM_SEND_BUFFER in the kernel, twisted's own write buffer and the
+            client's receive buffer can still be on the way, which lag doesn't show. A slow client only shows up
+            once that's full and it gets backed up and starts skipping frames.
+        """
+        newest = self.latest[1] if self.latest else None
+        return [{
+            'client': client.request.getClientIP(),
+            'frames_sent': client.frames_sent,
+            'frames_skipped': client.frames_skipped,
+            'backed_up': client.paused,
+            'lag': newest - client.last_sent_timestamp if newest is not None and client.last_sent_timestamp is not None else None,
+        } for client in list(self.clients)]
@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+import json
+import os
+
+import settings
+
+COLUMNS = ('id', 'file_name', 'size', 'created', 'start_time', 'end_time', 'frames', 'motion_events')
+
+
+class RecordingCatalog(object):
+    """ Saved recordings in sqlite, so listing them doesn't mean listing and sorting the whole directory.
+
+        The directory is only scanned once at startup, to pick up recordings made without the catalog and
+        forget deleted ones. After that finished encoding jobs keep it up to date.
+    """
+
+    def __init__(self, path=settings.RECORDING_CATALOG_DB, directory=".", prefix="pool-", extension=".avi"):
+        self.lock = threading.Lock()
+        self.directory = directory
+        self.prefix = prefix
+        self.extension = extension
+        self.db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS recordings (id INTEGER PRIMARY KEY, file_name TEXT NOT NULL UNIQUE, "
+                        "size INTEGER, created REAL, start_time REAL, end_time REAL, frames INTEGER, motion_events TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS recordings_created ON recordings (created)")
+        self.db.commit()
+        self.sync()
+
+    def sync(self):
+        file_names = set(x for x in os.listdir(self.directory) if x.startswith(self.prefix) and x.endswith(self.extension))
+        with self.lock:
+            known = set(row[0] for row in self.db.execute("SELECT file_name FROM recordings"))
+            self.db.executemany("DELETE FROM recordings WHERE file_name = ?", [(x,) for x in known - file_names])
+        for file_name in sorted(file_names - known):
+            self.add(file_name, created=os.path.getmtime(self.path(file_name)))
+
+    def path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def add(self, file_name, created=None, start_time=None, end_time=None, frames=None, motion_events=None):
+        """ Add a recording, or update one that was written again. Values that aren't given are kept. """
+        values = {
+            'size': os.path.getsize(self.path(file_name)),
+            'created': created,
+            'start_time': start_time,
+            'end_time': end_time,
+            'frames': frames,
+            'motion_events': json.dumps(motion_events) if motion_events is not None else None,
+        }
+        values = dict((key, value) for (key, value) in values.items() if value is not None)
+        with self.lock:
+            row = self.db.execute("SELECT id FROM recordings WHERE file_name = ?", (file_name,)).fetchone()
+            if row:
+                self.db.execute("UPDATE recordings SET %s WHERE id = ?" % ", ".join("%s = ?" % key for key in values),
+                                values.values() + [row[0]])
+                recording_id = row[0]
+            else:
+                values['file_name'] = file_name
+                recording_id = self.db.execute("INSERT INTO recordings (%s) VALUES (%s)" % (", ".join(values), ", ".join("?" * len(values))),
+                                               values.values()).lastrowid
+            self.db.commit()
+        return recording_id
+
+    def to_dict(self, row):
+        recording = dict(zip(COLUMNS, row))
+        recording['motion_events'] = json.loads(recording['motion_events']) if recording['motion_events'] else []
+        recording['duration'] = recording['end_time'] - recording['start_time'] if recording['end_time'] is not None and recording['start_time'] is not None else None
+        return recording
+
+    def get(self, recording_id):
+        with self.lock:
+            row = self.db.execute("SELECT %s FROM recordings WHERE id = ?" % ", ".join(COLUMNS), (recording_id,)).fetchone()
+        return self.to_dict(row) if row else None
+
+    def page(self, page=0, per_page=settings.VIDEOS_PER_PAGE):
+        """ One page of recordings, newest first, and the total number of recordings """
+        with self.lock:
+            rows = self.db.execute("SELECT %s FROM recordings ORDER BY created DESC, id DESC LIMIT ? OFFSET ?" % ", ".join(COLUMNS),
+                                   (per_page, page * per_page)).fetchall()
+            total = self.db.execute("SELECT COUNT(*) FROM recordings").fetchone()[0]
+        return ([self.to_dict(row) for row in rows], total)
+
+    def latest(self):
+        (recordings, total) = self.page(0, 1)
+        return recordings[0] if recordings else None
@@ -0,0 +1,69 @@
+import collections
+import threading
+
+from twisted.internet import reactor, defer
+
+
+class Command(object):
+    """ Something the api asks the recorder to do. reply is a deferred that fires on the reactor thread once
+        the recorder is done with it, with the result or a failure.
+    """
+
+    def __init__(self, name, kwargs):
+        self.name = name
+        self.kwargs = kwargs
+        self.reply = defer.Deferred()
+        # Commands that were coalesced into this one and get the same reply
+        self.coalesced = []
+
+    def key(self):
+        return (self.name, tuple(sorted(self.kwargs.items())))
+
+    def succeed(self, result=None):
+        """ Thread safe """
+        for command in [self] + self.coalesced:
+            reactor.callFromThread(command.reply.callback, result)
+
+    def fail(self, error):
+        """ Thread safe """
+        for command in [self] + self.coalesced:
+            reactor.callFromThread(command.reply.errback, error)
+
+
+class CommandBus(object):
+    """ Hands commands from the api thread to the recorder loop.
+
+        The queue is a deque, which appends and pops atomically, so neither side ever takes a lock. Sending
+        a command wakes the recorder loop if it's waiting. Identical commands sent before the loop gets to them
+        are coalesced into the first one, so ten saves in a row only save once.
+    """
+
+    def __init__(self):
+        self.queue = collections.deque()
+        self.wakeup = threading.Event()
+
+    def send(self, name, **kwargs):
+        """ Returns the command's reply deferred """
+        command = Command(name, kwargs)
+        self.queue.append(command)
+        self.wakeup.set()
+        return command.reply
+
+    def wait(self, timeout):
+        """ Sleep until a command is sent or the timeout runs out """
+        self.wakeup.wait(timeout)
+
+    def drain(self):
+        """ The commands sent since the last call, oldest first, with duplicates coalesced """
+        self.wakeup.clear()
+        commands = collections.OrderedDict()
+        while True:
+            try:
+                command = self.queue.popleft()
+            except IndexError:
+                break
+            if command.key() in commands:
+                commands[command.key()].coalesced.append(command)
+            else:
+                commands[command.key()] = command
+        return commands.values()
@@ -0,0 +1,38 @@
+import cv2
+import numpy
+
+
+class FrameConverter(object):
+    """ Converts freenect frames into the arrays the rest of the recorder wants, without going through strings.
+
+        Results are written into output arrays that are reused for every frame, so they are only valid until
+        the next conversion. Pass reuse=False for frames that are kept around or handed to other threads.
+    """
+
+    def __init__(self):
+        self.video_output = None
+        self.depth_output = None
+
+    def output_like(self, output, shape, dtype):
+        if output is None or output.shape != shape or output.dtype != dtype:
+            output = numpy.empty(shape, dtype=dtype)
+        return output
+
+    def video_to_bgr(self, video, reuse=True):
+        """ freenect gives us RGB, everything else wants BGR """
+        if not reuse:
+            return cv2.cvtColor(video, cv2.COLOR_RGB2BGR)
+        self.video_output = self.output_like(self.video_output, video.shape, video.dtype)
+        cv2.cvtColor(video, cv2.COLOR_RGB2BGR, self.video_output)
+        return self.video_output
+
+    def depth_to_8bit(self, depth, reuse=True, pretty=True):
+        """ Squash 11 bit depth values into 8 bits in place, like the pretty_depth demo in freenect, and cast them """
+        output = self.output_like(self.depth_output if reuse else None, depth.shape, numpy.uint8)
+        if pretty:
+            numpy.clip(depth, 0, 2**10 - 1, depth)
+            numpy.right_shift(depth, 2, out=depth)
+        numpy.copyto(output, depth, casting='unsafe')
+        if reuse:
+            self.depth_output = output
+        return output
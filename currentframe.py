@@ -0,0 +1,75 @@
+import threading
+import os
+import cv2
+import numpy
+
+import settings
+
+
+class CurrentFrame(object):
+    """ The newest preview jpg, numbered so clients can tell whether they already have it.
+
+        Smaller versions are made when someone asks for them, once per width and frame however many clients ask,
+        and kept until the next frame comes in. Making one takes a few milliseconds, so the api asks for widths
+        that aren't cached() yet on another thread.
+    """
+
+    def __init__(self, quality=settings.ENCODE_TIERS.get('preview', (None, 80))[1], max_variants=8):
+        self.quality = quality
+        self.max_variants = max_variants
+        self.lock = threading.Lock()
+        # Sequence numbers start over when the recorder restarts, so etags include this as well
+        self.instance = os.urandom(4).encode("hex")
+        self.sequence = 0
+        self.jpg = None
+        self.variants = {}
+        # A lock per width being made from the current frame, so clients asking at the same time wait for one
+        # resize instead of each doing their own
+        self.resizing = {}
+
+    def update(self, jpg):
+        """ Called with every new frame """
+        with self.lock:
+            self.sequence += 1
+            self.jpg = jpg
+            self.variants = {}
+            self.resizing = {}
+
+    def etag(self, sequence, width):
+        return '"%s-%s-%s"' % (self.instance, sequence, width or "full")
+
+    def cached(self, width):
+        """ (etag, jpg) of the newest frame at width if it's been made already, otherwise None """
+        with self.lock:
+            return self.variants.get(width)
+
+    def get(self, width=None):
+        """ (etag, jpg) of the newest frame, scaled down to width if it's wider than that. None without any frame.
+            Cached for the frame it was made from only, and only a few widths so odd requests can't fill memory.
+        """
+        with self.lock:
+            (sequence, jpg, variants) = (self.sequence, self.jpg, self.variants)
+            if width and width not in variants and (width in self.resizing or len(self.resizing) < self.max_variants):
+                resizing = self.resizing.setdefault(width, threading.Lock())
+            else:
+                resizing = None
+        if jpg is None:
+            return None
+        if not width:
+            return (self.etag(sequence, None), jpg)
+        if width in variants:
+            return variants[width]
+        if not resizing:
+            return self.resize(sequence, jpg, width)
+        with resizing:
+            if width not in variants:
+                variants[width] = self.resize(sequence, jpg, width)
+            return variants[width]
+
+    def resize(self, sequence, jpg, width):
+        image = cv2.imdecode(numpy.frombuffer(jpg, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+        (height, original_width) = image.shape[:2]
+        if width >= original_width:
+            return (self.etag(sequence, None), jpg)
+        image = cv2.resize(image, (width, max(1, height * width / original_width)), interpolation=cv2.INTER_AREA)
+        return (self.etag(sequence, width), cv2.imencode(".jpg", image, (cv2.IMWRITE_JPEG_QUALITY, self.quality))[1].tostring())
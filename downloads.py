@@ -0,0 +1,90 @@
+import os
+
+from zope.interface import implementer
+from twisted.internet.interfaces import IPullProducer
+
+
+def parse_range(header, size):
+    """ (start, end) of a single byte range header, end included. None without a usable range, which means the
+        whole file, False when the range is outside the file. Multiple ranges are answered with the whole file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    (start, _, end) = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            # The last n bytes
+            length = int(end)
+            return (max(0, size - length), size - 1) if length and size else False
+        (start, end) = (int(start), int(end) if end else size - 1)
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return (start, min(end, size - 1))
+
+
+@implementer(IPullProducer)
+class FileRangeProducer(object):
+    """ Writes part of a file to a request a chunk at a time, reading the next chunk only when twisted asks for it,
+        so a download never holds more than a chunk in memory and doesn't block the reactor.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, request, file_name, start, length):
+        self.request = request
+        self.file = open(file_name, "rb")
+        self.file.seek(start)
+        self.remaining = length
+
+    def start(self):
+        self.request.registerProducer(self, False)
+
+    def resumeProducing(self):
+        if not self.request:
+            return
+        data = self.file.read(min(self.CHUNK_SIZE, self.remaining)) if self.remaining else ""
+        if data:
+            self.remaining -= len(data)
+            self.request.write(data)
+        if not data or not self.remaining:
+            request = self.request
+            self.stopProducing()
+            request.unregisterProducer()
+            request.finish()
+
+    def pauseProducing(self):
+        pass
+
+    def stopProducing(self):
+        self.file.close()
+        self.request = None
+
+
+def send_file(request, file_name, content_type="application/octet-stream", download_name=None):
+    """ Serve a file or the byte range the request asks for, streamed by a FileRangeProducer """
+    size = os.path.getsize(file_name)
+    byte_range = parse_range(request.getHeader("range"), size)
+    request.setHeader("Content-Type", content_type)
+    request.setHeader("Accept-Ranges", "bytes")
+    if download_name:
+        request.setHeader("Content-Disposition", 'attachment; filename="%s"' % download_name)
+
+    if byte_range is False:
+        request.setResponseCode(416)
+        request.setHeader("Content-Range", "bytes */%s" % size)
+        request.finish()
+        return
+    if byte_range:
+        (start, end) = byte_range
+        request.setResponseCode(206)
+        request.setHeader("Content-Range", "bytes %s-%s/%s" % (start, end, size))
+    else:
+        (start, end) = (0, size - 1)
+    length = end - start + 1
+    request.setHeader("Content-Length", str(length))
+
+    if request.method == "HEAD" or not length:
+        request.finish()
+        return
+    FileRangeProducer(request, file_name, start, length).start()
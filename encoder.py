@@ -0,0 +1,126 @@
+import threading
+import collections
+import time
+import cv2
+
+import settings
+
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+BLOCK = 'block'
+
+
+class EncoderPool(object):
+    """ Encodes raw frames to jpg on a pool of worker threads, cv2 releases the GIL while encoding.
+
+        Every frame is encoded once per tier, a tier being a width (None for full resolution) and a jpg quality.
+        The callback gets a dict of jpgs by tier name. Tiers with the same width share one resized frame.
+
+        Frames are handed to the callback in the order they were submitted, whichever worker finishes first.
+        When the workers fall behind and the queue is full, the drop policy decides what happens:
+        'oldest' drops the oldest queued frame, 'newest' drops the submitted frame, 'block' waits for space.
+        With no workers, frames are encoded right away on the calling thread.
+    """
+
+    def __init__(self, callback, workers=settings.ENCODER_WORKERS, queue_size=settings.ENCODER_QUEUE_SIZE,
+                 drop_policy=settings.ENCODER_DROP_POLICY, tiers=settings.ENCODE_TIERS):
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError("Unknown drop policy %s" % drop_policy)
+
+        self.callback = callback
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.tiers = tiers
+
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.keep_running = True
+
+        # Encoded frames waiting for earlier frames to finish, by sequence number. None marks a dropped frame.
+        self.finished = {}
+        # Frames dropped from the queue, picked up by the next delivery so the capture thread never waits for it
+        self.dropped = collections.deque()
+        self.next_sequence = 0
+        self.next_delivery = 0
+        self.delivery_lock = threading.Lock()
+
+        self.encoded_frames = 0
+        self.dropped_frames = 0
+
+        self.workers = []
+        for i in range(workers):
+            t = threading.Thread(target=self.work)
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def resize(self, frame, width):
+        if not width or width >= frame.shape[1]:
+            return frame
+        height = int(round(frame.shape[0] * float(width) / frame.shape[1]))
+        return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+    def encode(self, frame):
+        resized = {}
+        jpg_frames = {}
+        for (name, (width, quality)) in self.tiers.items():
+            if width not in resized:
+                resized[width] = self.resize(frame, width)
+            (retval, jpg_frames[name]) = cv2.imencode(".jpg", resized[width], (cv2.IMWRITE_JPEG_QUALITY, quality))
+        return jpg_frames
+
+    def submit(self, frame, timestamp=None, copy=True):
+        """ Queue a frame for encoding. The frame is copied unless told otherwise, so the caller can reuse it right away. """
+        timestamp = timestamp if timestamp is not None else time.time()
+        if not self.workers:
+            self.callback(self.encode(frame), timestamp)
+            self.encoded_frames += 1
+            return True
+
+        with self.condition:
+            if len(self.queue) >= self.queue_size:
+                if self.drop_policy == DROP_NEWEST:
+                    self.dropped_frames += 1
+                    return False
+                elif self.drop_policy == DROP_OLDEST:
+                    (sequence, _, _) = self.queue.popleft()
+                    self.dropped_frames += 1
+                    self.dropped.append(sequence)
+                else:
+                    while len(self.queue) >= self.queue_size and self.keep_running:
+                        self.condition.wait()
+
+            self.queue.append((self.next_sequence, frame.copy() if copy else frame, timestamp))
+            self.next_sequence += 1
+            self.condition.notify_all()
+        return True
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.queue and self.keep_running:
+                    self.condition.wait()
+                if not self.keep_running:
+                    return
+                (sequence, frame, timestamp) = self.queue.popleft()
+                self.condition.notify_all()
+
+            self.deliver(sequence, (self.encode(frame), timestamp))
+
+    def deliver(self, sequence, result):
+        """ Store a finished frame and pass on every frame that is now next in line, skipping dropped ones. """
+        with self.delivery_lock:
+            self.finished[sequence] = result
+            while self.dropped:
+                self.finished[self.dropped.popleft()] = None
+            while self.next_delivery in self.finished:
+                result = self.finished.pop(self.next_delivery)
+                self.next_delivery += 1
+                if result is not None:
+                    self.encoded_frames += 1
+                    self.callback(*result)
+
+    def stop(self):
+        with self.condition:
+            self.keep_running = False
+            self.condition.notify_all()
@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+import bisect
+import time
+import datetime
+
+import settings
+
+
+class MotionEvent(object):
+    def __init__(self, start=None, end=None):
+        self.start = start if start else datetime.datetime.now()
+        self.end = end
+        # Row id in the event store
+        self.id = None
+
+    def ago(self):
+        return datetime.datetime.now() - self.end if self.end else datetime.timedelta(seconds=0)
+
+
+def to_timestamp(dt):
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1000000.0
+
+
+def from_timestamp(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp) if timestamp is not None else None
+
+
+class MotionEventStore(object):
+    """ Keeps motion events in sqlite, indexed by start and end, with the newest events in memory.
+
+        Range queries that only reach back as far as the in-memory tail are answered from it with bisect,
+        older ones go to sqlite. Used from the analysis thread and the api thread, so everything takes the lock.
+    """
+
+    def __init__(self, path=settings.MOTION_EVENT_DB, tail_length=settings.MOTION_EVENT_TAIL):
+        self.lock = threading.Lock()
+        self.tail_length = tail_length
+        self.db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS motion_events (id INTEGER PRIMARY KEY, start REAL NOT NULL, end REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS motion_events_start ON motion_events (start)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS motion_events_end ON motion_events (end)")
+        self.db.commit()
+
+        # Newest events and their start timestamps, oldest first
+        self.tail = []
+        self.tail_starts = []
+        # Everything that started at or after this is in the tail
+        self.tail_complete_from = None
+        self.load_tail()
+
+    def load_tail(self):
+        # Events still going when the recorder stopped won't be finished any more
+        self.db.execute("UPDATE motion_events SET end = start WHERE end IS NULL")
+        self.db.commit()
+        rows = self.db.execute("SELECT id, start, end FROM motion_events ORDER BY start DESC LIMIT ?", (self.tail_length,)).fetchall()
+        for (event_id, start, end) in reversed(rows):
+            event = MotionEvent(from_timestamp(start), from_timestamp(end))
+            event.id = event_id
+            self.tail.append(event)
+            self.tail_starts.append(start)
+        self.tail_complete_from = self.tail_starts[0] if len(rows) == self.tail_length else float('-inf')
+
+    def add(self, event):
+        with self.lock:
+            start = to_timestamp(event.start)
+            end = to_timestamp(event.end) if event.end else None
+            event.id = self.db.execute("INSERT INTO motion_events (start, end) VALUES (?, ?)", (start, end)).lastrowid
+            self.db.commit()
+
+            self.tail.append(event)
+            self.tail_starts.append(start)
+            if len(self.tail) > self.tail_length:
+                del self.tail[0]
+                del self.tail_starts[0]
+                self.tail_complete_from = self.tail_starts[0]
+
+    def finish(self, event):
+        """ Store the end of an event that was added before """
+        with self.lock:
+            self.db.execute("UPDATE motion_events SET end = ? WHERE id = ?", (to_timestamp(event.end), event.id))
+            self.db.commit()
+
+    def last(self):
+        return self.tail[-1] if self.tail else None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM motion_events").fetchone()[0]
+
+    def between(self, start, end):
+        """ (start, end) timestamps of the events overlapping [start, end], oldest first. Ongoing events end now. """
+        now = time.time()
+        with self.lock:
+            if start >= self.tail_complete_from:
+                # Events follow each other without overlapping, so only the last one starting before start
+                # can reach into the range, and nothing starting after end can
+                first = max(0, bisect.bisect_right(self.tail_starts, start) - 1)
+                last = bisect.bisect_right(self.tail_starts, end)
+                events = [(s, to_timestamp(event.end) if event.end else now) for (s, event) in zip(self.tail_starts[first:last], self.tail[first:last])]
+                return [(s, e) for (s, e) in events if e >= start]
+
+            rows = self.db.execute("SELECT start, end FROM motion_events WHERE start <= ? AND (end >= ? OR end IS NULL) ORDER BY start",
+                                   (end, start)).fetchall()
+            return [(s, e if e is not None else now) for (s, e) in rows]
+
+    def summary(self, start, end):
+        """ Number of events and seconds of motion between start and end, counting only the part inside the range """
+        events = self.between(start, end)
+        return {
+            'start': start,
+            'end': end,
+            'events': len(events),
+            'motion_seconds': sum(min(e, end) - max(s, start) for (s, e) in events),
+        }
@@ -1,21 +1,66 @@
-import cv2, cv
+import cv2
 import numpy
 import datetime
+import time
 import settings
+from eventstore import MotionEvent, MotionEventStore
+from pipeline import Throughput
 
-class MotionEvent(object):
-	def __init__(self, start=None, end=None):
-		self.start = start if start else datetime.datetime.now()
-		self.end = end
+class MotionZones(object):
+	""" Polygon zones on the frame, with coordinates from 0 to 1. Ignored zones don't count towards motion at all.
+
+		Every pixel gets a label for the combination of zones it is in, and pixels are sorted by label once,
+		so the largest value per zone can be found for every frame in a single pass however many zones there are.
+	"""
+	def __init__(self, zones, width, height):
+		self.names = sorted(zones.keys())
+		membership = numpy.zeros((height, width), dtype=numpy.int64)
+		for (i, name) in enumerate(self.names):
+			mask = numpy.zeros((height, width), dtype=numpy.uint8)
+			polygon = numpy.array([(x * (width - 1), y * (height - 1)) for (x, y) in zones[name]['polygon']], dtype=numpy.int32)
+			cv2.fillPoly(mask, [polygon], 1)
+			membership |= mask.astype(numpy.int64) << i
+
+		(combinations, labels) = numpy.unique(membership.ravel(), return_inverse=True)
+		self.order = numpy.argsort(labels, kind='mergesort')
+		self.starts = numpy.searchsorted(labels[self.order], numpy.arange(len(combinations)))
+
+		# Which label combinations make up every zone, and which count towards motion overall
+		self.zone_labels = dict((name, [j for (j, c) in enumerate(combinations) if c >> i & 1]) for (i, name) in enumerate(self.names))
+		ignored = sum(1 << i for (i, name) in enumerate(self.names) if zones[name].get('ignore'))
+		watched = sum(1 << i for (i, name) in enumerate(self.names) if not zones[name].get('ignore'))
+		if watched:
+			self.counted_labels = [j for (j, c) in enumerate(combinations) if c & watched and not c & ignored]
+		else:
+			self.counted_labels = [j for (j, c) in enumerate(combinations) if not c & ignored]
+
+	def scores(self, motion_image):
+		""" Returns the largest value in motion_image overall (leaving out ignored zones) and for every zone """
+		label_max = numpy.maximum.reduceat(motion_image.ravel()[self.order], self.starts)
+		zone_scores = dict((name, float(label_max[labels].max()) if labels else 0.0) for (name, labels) in self.zone_labels.items())
+		overall = float(label_max[self.counted_labels].max()) if self.counted_labels else 0.0
+		return (overall, zone_scores)
 
-	def ago(self):
-		return datetime.datetime.now() - self.end if self.end else datetime.timedelta(seconds=0)
 
 class MotionDetector(object):
-	def __init__(self, threshold = settings.MOTION_THRESHOLD, min_sec_between_events=settings.MOTION_EVENT_GAP, timeout_seconds=settings.MOTION_TIMEOUT):
+	""" Detects motion by comparing a small, blurred grayscale version of every frame to a running average.
+		motion_avg is the largest difference of any pixel, motion events start and end when it crosses the threshold.
+		With zones, motion_avg only looks at the zones that aren't ignored, and every zone gets its own score.
+	"""
+	def __init__(self, threshold = settings.MOTION_THRESHOLD, min_sec_between_events=settings.MOTION_EVENT_GAP, timeout_seconds=settings.MOTION_TIMEOUT, analysis_size=settings.MOTION_ANALYSIS_SIZE, zones=settings.MOTION_ZONES, callback=None, event_db=settings.MOTION_EVENT_DB):
+		self.analysis_size = analysis_size
+		# Called with the event whenever a motion event starts or ends
+		self.callback = callback
+		self.zones = MotionZones(zones, *analysis_size) if zones else None
+		self.zone_scores = {}
+		# Last time motion was seen in every zone
+		self.zone_last_motion = {}
+		# Reused for every frame
+		self.small_frame = None
+		self.grey_frame = None
+		self._smoothed_frame = None
 		self.running_average = None
 		self.running_average_converted = None
-		self._smoothed_frame = None
 		self.motion_image = None
 
 		self.min_sec_between_events = min_sec_between_events
@@ -23,7 +68,8 @@ class MotionDetector(object):
 		self.timeout_seconds = timeout_seconds
 		self.timeout = datetime.timedelta(seconds=timeout_seconds)
 		self.threshold = threshold
-		self.motion_events = []
+		# None keeps the events in memory only
+		self.motion_events = MotionEventStore(event_db)
 		self.motion_avg = None
 
 		# Is there motion being detected right now
@@ -32,44 +78,173 @@ class MotionDetector(object):
 		self.last_motion = None
 
 	def last_event(self):
-		return self.motion_events[-1] if self.motion_events else None
+		return self.motion_events.last()
 
 	def should_start_new_event(self):
-		return not self.motion_events or self.last_event().ago() > self.min_time_between_events
+		return not self.last_event() or self.last_event().ago() > self.min_time_between_events
 
-	def update(self, frame):
-		size = cv.GetSize(frame)
-		if self.motion_image is None:
-			self.running_average = cv.CreateImage(size, 32, 3)
-			self.running_average_converted = cv.CreateImage(size, frame.depth, 3)
-			self._smoothed_frame = cv.CreateImage(size, frame.depth, 3)
-			self.motion_image = cv.CreateImage(size, frame.depth, 3)
-			self.grey_image = cv.CreateImage(size, frame.depth, 1)
-			return
+	def measure(self, frame):
+		""" Takes a BGR frame as an array, returns the motion value or None for the first frame """
+		(width, height) = self.analysis_size
+		first_frame = self.motion_image is None
+		if first_frame:
+			self.small_frame = numpy.empty((height, width, 3), dtype=numpy.uint8)
+			self.grey_frame = numpy.empty((height, width), dtype=numpy.uint8)
+			self._smoothed_frame = numpy.empty((height, width), dtype=numpy.uint8)
+			self.motion_image = numpy.empty((height, width), dtype=numpy.uint8)
 
-		cv.Smooth(frame, self._smoothed_frame, cv.CV_GAUSSIAN, 9, 0)
-		cv.AbsDiff(self._smoothed_frame, self.running_average_converted, self.motion_image)
+		cv2.resize(frame, (width, height), self.small_frame, interpolation=cv2.INTER_AREA)
+		cv2.cvtColor(self.small_frame, cv2.COLOR_BGR2GRAY, self.grey_frame)
+		cv2.GaussianBlur(self.grey_frame, (settings.MOTION_BLUR_SIZE, settings.MOTION_BLUR_SIZE), 0, self._smoothed_frame)
 
-		cv.RunningAvg(self._smoothed_frame, self.running_average, 0.5, None)
-		cv.ConvertScale(self.running_average, self.running_average_converted)
+		if first_frame:
+			self.running_average = self._smoothed_frame.astype(numpy.float32)
+			self.running_average_converted = self._smoothed_frame.copy()
+			return None
+
+		cv2.absdiff(self._smoothed_frame, self.running_average_converted, self.motion_image)
+
+		cv2.accumulateWeighted(self._smoothed_frame, self.running_average, 0.5)
+		cv2.convertScaleAbs(self.running_average, self.running_average_converted)
+
+		if self.zones:
+			(motion_avg, self.zone_scores) = self.zones.scores(self.motion_image)
+			now = datetime.datetime.now()
+			for (name, score) in self.zone_scores.items():
+				if score > self.threshold:
+					self.zone_last_motion[name] = now
+			return motion_avg
+		return cv2.minMaxLoc(self.motion_image)[1]
+
+	def update(self, frame):
+		motion_avg = self.measure(frame)
+		if motion_avg is None:
+			return
 
-		#motion_avg = float(cv.Sum(self.motion_image)[0])/(size[0]*size[1]) 
-		cv.CvtColor(self.motion_image, self.grey_image, cv.CV_BGR2GRAY)
-		motion_avg = cv.MinMaxLoc(self.grey_image)[1]
 		if motion_avg > self.threshold and not self.motion_detected and self.should_start_new_event():
-			self.motion_events.append(MotionEvent())
+			event = MotionEvent()
+			self.motion_events.add(event)
 			self.motion_detected = True
+			if self.callback:
+				self.callback(event)
 		elif motion_avg < self.threshold and self.motion_detected:
 			last_event = self.last_event()
 			last_event.end = datetime.datetime.now()
-			self.motion_events[-1] = last_event
+			self.motion_events.finish(last_event)
 			self.motion_detected = False
+			if self.callback:
+				self.callback(last_event)
 
 		self.motion_avg = motion_avg
 
+	def zone_activity(self):
+		""" For every zone: its current score, whether it had motion within the timeout, and seconds since then """
+		now = datetime.datetime.now()
+		activity = {}
+		for name in (self.zones.names if self.zones else []):
+			last_motion = self.zone_last_motion.get(name)
+			activity[name] = {
+				'score': self.zone_scores.get(name, 0.0),
+				'active': bool(last_motion and now - last_motion <= self.timeout),
+				'seconds_since_motion': (now - last_motion).total_seconds() if last_motion else None,
+			}
+		return activity
+
 	def recent_motion(self):
 		last_event = self.last_event()
 		if not last_event or last_event.ago() > self.timeout: 
 			return False
 
 		return True
+
+
+class AnalysisCadence(object):
+	""" Decides which frames get motion detection. Every frame while there's been motion recently, otherwise
+		idle_rate frames per second, plus any frame where a cheap check on a sparse grid of pixels sees a change,
+		which also switches back to every frame right away.
+	"""
+	FULL = 'full'
+	IDLE = 'idle'
+
+	def __init__(self, motion_detector, idle_rate=settings.MOTION_IDLE_RATE, idle_after=settings.MOTION_IDLE_AFTER,
+			wake_threshold=settings.MOTION_WAKE_THRESHOLD, wake_points=settings.MOTION_WAKE_POINTS, grid_step=16):
+		self.motion_detector = motion_detector
+		self.idle_interval = 1.0/idle_rate
+		self.idle_after = idle_after
+		self.wake_threshold = wake_threshold
+		self.wake_points = wake_points
+		self.grid_step = grid_step
+
+		self.mode = self.FULL
+		self.last_analysis = 0
+		self.last_recent_motion = time.time()
+		self.last_sample = None
+		self.check_time = Throughput()
+		self.analysis_time = Throughput()
+		self.skipped = 0
+
+	def cheap_check(self, frame):
+		""" Did enough pixels on the grid change since the last frame """
+		started = time.time()
+		sample = frame[::self.grid_step, ::self.grid_step, 1].astype(numpy.int16)
+		changed = self.last_sample is not None and numpy.count_nonzero(numpy.abs(sample - self.last_sample) > self.wake_threshold) >= self.wake_points
+		self.last_sample = sample
+		self.check_time.tick(time.time() - started)
+		return changed
+
+	def analyse(self, frame):
+		""" Run motion detection on the frame if it's due, returns whether it was """
+		now = time.time()
+		if self.mode == self.IDLE:
+			if self.cheap_check(frame):
+				self.mode = self.FULL
+				self.last_recent_motion = now
+			elif now - self.last_analysis < self.idle_interval:
+				self.skipped += 1
+				return False
+
+		started = time.time()
+		self.motion_detector.update(frame)
+		self.analysis_time.tick(time.time() - started)
+		self.last_analysis = now
+
+		if self.motion_detector.recent_motion():
+			self.mode = self.FULL
+			self.last_recent_motion = now
+		elif self.mode == self.FULL and now - self.last_recent_motion > self.idle_after:
+			self.mode = self.IDLE
+			self.last_sample = None
+		return True
+
+	def stats(self):
+		return {
+			'mode': self.mode,
+			'analysis_fps': self.analysis_time.rate,
+			'analysis_ms': self.analysis_time.seconds_per_item * 1000,
+			'check_ms': self.check_time.seconds_per_item * 1000,
+			'skipped': self.skipped,
+		}
+
+
+class LegacyMotionDetector(MotionDetector):
+	""" The old full resolution, full colour detector on the cv api, kept to compare against. Takes IplImages. """
+	def measure(self, frame):
+		# Only this detector needs the old cv api, which newer opencv builds don't have
+		import cv
+		size = cv.GetSize(frame)
+		if self.motion_image is None:
+			self.running_average = cv.CreateImage(size, 32, 3)
+			self.running_average_converted = cv.CreateImage(size, frame.depth, 3)
+			self._smoothed_frame = cv.CreateImage(size, frame.depth, 3)
+			self.motion_image = cv.CreateImage(size, frame.depth, 3)
+			self.grey_image = cv.CreateImage(size, frame.depth, 1)
+			return None
+
+		cv.Smooth(frame, self._smoothed_frame, cv.CV_GAUSSIAN, 9, 0)
+		cv.AbsDiff(self._smoothed_frame, self.running_average_converted, self.motion_image)
+
+		cv.RunningAvg(self._smoothed_frame, self.running_average, 0.5, None)
+		cv.ConvertScale(self.running_average, self.running_average_converted)
+
+		cv.CvtColor(self.motion_image, self.grey_image, cv.CV_BGR2GRAY)
+		return cv.MinMaxLoc(self.grey_image)[1]
@@ -0,0 +1,85 @@
+import collections
+import itertools
+import json
+import time
+
+from twisted.internet import reactor, task
+
+
+class NotificationChannel(object):
+    """ Pushes recorder state changes to clients, as server-sent events or to long polling requests.
+
+        Events can be published from any thread and are handled on the reactor thread. An event that's the same
+        as the last one of its kind is dropped, so clients only hear about changes. The newest events are kept,
+        so clients reconnecting with Last-Event-ID or polling with since don't miss any.
+    """
+
+    def __init__(self, history_length=100, poll_timeout=30, keepalive_seconds=15):
+        self.poll_timeout = poll_timeout
+        self.ids = itertools.count(1)
+        self.history = collections.deque(maxlen=history_length)
+        # Data of the last event of every kind
+        self.last = {}
+        self.streams = []
+        self.polls = []
+        self.keepalive = task.LoopingCall(self.send_keepalive)
+        self.keepalive_seconds = keepalive_seconds
+
+    def publish(self, event, data=None):
+        """ Thread safe """
+        reactor.callFromThread(self.deliver, event, data)
+
+    def deliver(self, event, data):
+        if event in self.last and self.last[event] == data:
+            return
+        self.last[event] = data
+        notification = {'id': next(self.ids), 'event': event, 'data': data, 'time': time.time()}
+        self.history.append(notification)
+
+        for request in list(self.streams):
+            self.write_event(request, notification)
+        for (request, call) in list(self.polls):
+            self.answer_poll(request, call, [notification])
+
+    def since(self, last_id):
+        return [notification for notification in self.history if notification['id'] > last_id]
+
+    def write_event(self, request, notification):
+        request.write("id: %s\nevent: %s\ndata: %s\n\n" % (notification['id'], notification['event'], json.dumps(notification)))
+
+    def subscribe(self, request, last_id=None):
+        """ Keep the request open as an event stream """
+        request.setHeader("Content-Type", "text/event-stream")
+        request.setHeader("Cache-Control", "no-cache")
+        request.write("retry: 2000\n\n")
+        for notification in self.since(last_id) if last_id is not None else []:
+            self.write_event(request, notification)
+        self.streams.append(request)
+        request.notifyFinish().addBoth(lambda result: self.streams.remove(request))
+        if not self.keepalive.running:
+            self.keepalive.start(self.keepalive_seconds, now=False)
+
+    def send_keepalive(self):
+        for request in list(self.streams):
+            request.write(":\n\n")
+
+    def poll(self, request, last_id):
+        """ Answer with the events after last_id, waiting up to poll_timeout for one if there are none yet """
+        notifications = self.since(last_id)
+        if notifications:
+            return self.answer_poll(request, None, notifications)
+        call = reactor.callLater(self.poll_timeout, lambda: self.answer_poll(request, call, []))
+        self.polls.append((request, call))
+        request.notifyFinish().addBoth(lambda result: self.forget_poll(request, call))
+
+    def forget_poll(self, request, call):
+        if (request, call) in self.polls:
+            self.polls.remove((request, call))
+        if call and call.active():
+            call.cancel()
+
+    def answer_poll(self, request, call, notifications):
+        self.forget_poll(request, call)
+        request.setHeader("Content-Type", "application/json")
+        request.write(json.dumps(notifications))
+        request.finish()
@@ -0,0 +1,116 @@
+import threading
+import traceback
+import Queue
+import time
+
+import settings
+
+
+class Throughput(object):
+    """ Keeps a moving average of items per second and of the time spent per item. """
+
+    def __init__(self, smoothing=0.1):
+        self.smoothing = smoothing
+        self.rate = 0.0
+        self.seconds_per_item = 0.0
+        self.count = 0
+        self.last_tick = None
+
+    def tick(self, seconds):
+        now = time.time()
+        if self.last_tick is not None and now > self.last_tick:
+            self.rate += self.smoothing * (1.0/(now - self.last_tick) - self.rate)
+        self.seconds_per_item += self.smoothing * (seconds - self.seconds_per_item)
+        self.last_tick = now
+        self.count += 1
+
+
+class Stage(object):
+    """ Runs handler on its own thread for every item put into the stage, and passes results on to the outputs.
+
+        The input queue is bounded, and putting never blocks: when the stage falls behind, the oldest
+        queued item is dropped to make room, so a slow stage can't hold up the one feeding it.
+        An exception in the handler is printed and the stage goes on with the next item, after calling
+        on_error(stage, exception) if given.
+    """
+
+    def __init__(self, name, handler, outputs=None, queue_size=settings.PIPELINE_QUEUE_SIZE, on_error=None):
+        self.name = name
+        self.handler = handler
+        self.on_error = on_error
+        self.errors = 0
+        self.outputs = outputs or []
+        self.queue = Queue.Queue(queue_size)
+        self.throughput = Throughput()
+        self.dropped = 0
+        self.keep_running = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.keep_running = False
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except Queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except Queue.Empty:
+                    pass
+
+    def next_item(self):
+        try:
+            return self.queue.get(timeout=0.1)
+        except Queue.Empty:
+            return None
+
+    def run(self):
+        while self.keep_running:
+            item = self.next_item()
+            if item is None:
+                continue
+            self.process(item)
+
+    def process(self, *args):
+        """ Run the handler and pass its result on """
+        started = time.time()
+        try:
+            result = self.handler(*args)
+        except Exception, e:
+            self.errors += 1
+            print "Pipeline stage %s failed:" % self.name
+            traceback.print_exc()
+            if self.on_error:
+                self.on_error(self, e)
+            return
+        self.throughput.tick(time.time() - started)
+        if result is not None:
+            for output in self.outputs:
+                output.put(result)
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'fps': self.throughput.rate,
+            'ms_per_item': self.throughput.seconds_per_item * 1000,
+            'processed': self.throughput.count,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'queued': self.queue.qsize()
+        }
+
+
+class SourceStage(Stage):
+    """ First stage of a pipeline, calls handler without arguments over and over instead of reading a queue. """
+
+    def run(self):
+        while self.keep_running:
+            self.process()
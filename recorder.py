@@ -2,11 +2,11 @@
 
 import cv2, cv
 import numpy
+import os
 import subprocess
 import time
 import freenect
 import random 
-import threading
 import copy
 import datetime
 import serial
@@ -14,13 +14,30 @@ import serial
 from api import Api
 from gui import Gui, Color
 from gui.vector import V
-from motion import MotionDetector
+from motion import MotionDetector, AnalysisCadence
+from ringbuffer import FrameRingBuffer
+from encoder import EncoderPool
+from pipeline import Stage, SourceStage
+from conversion import FrameConverter
+from scheduler import EncodeScheduler, EncodeJob, lower_priority
+from segments import SegmentEncoder
+from tracking import BallTracker
+from shots import ShotDetector
+from catalog import RecordingCatalog
+from thumbnails import ThumbnailCache
+from currentframe import CurrentFrame
 import calibration
 import settings
 
 DEBUG = settings.DEBUG
 SHOW_WINDOW = settings.SHOW_WINDOW
 
+H264_OPTIONS = ('-c:v', 'libx264', '-preset', 'fast', '-crf', '23')
+# The buffered jpgs go into the video as they are
+MJPEG_COPY_OPTIONS = ('-c:v', 'copy')
+# Files are written under this prefix and renamed once complete, so only finished videos are served
+PARTIAL_PREFIX = "partial-"
+
 class Recorder(object):
     def __init__(self, num_frames=settings.BUFFER_LENGTH, limit_fps=None):
         if SHOW_WINDOW:
@@ -29,23 +46,33 @@ class Recorder(object):
         self.last_video_frame = None
 
         self.num_frames = num_frames
-        self.frames = [None] * self.num_frames
-        self.current_jpg_frame = None
-        self.buffer_index = 0
+        self.frames = FrameRingBuffer(self.num_frames, path=settings.BUFFER_FILE)
+        self.current_frame = CurrentFrame()
+        self.encoder = EncoderPool(self.store_jpg_frame)
 
         self.keep_running = True
         self.frame_rate = 0
         self.last_frame = time.time()
         self.limit_fps = limit_fps
+        self.stages = []
+        self.latest_frame = None
 
         self.api = Api(self)
-        self.api_lock = threading.Lock()
+        # Commands waiting for their save job to finish, by job id
+        self.pending_commands = {}
 
-        self.motion_detector = MotionDetector()
+        self.motion_detector = MotionDetector(callback=self.motion_changed)
+        self.analysis_cadence = AnalysisCadence(self.motion_detector)
+        self.ball_tracker = BallTracker() if settings.BALL_TRACKING else None
+        self.shot_detector = ShotDetector()
 
         self.ser = serial.Serial('/dev/ttyUSB0', 9600, timeout=1)
-        self.encoding_subprocesses = []
+        self.scheduler = EncodeScheduler(self._save_buffer_to_video, snapshot=self.get_ordered_buffer)
+        self.catalog = RecordingCatalog()
+        self.thumbnails = ThumbnailCache()
+        self.segment_encoder = SegmentEncoder(lambda: self.frame_rate) if settings.SEGMENTED_ENCODING else None
         self.last_serial_command = None
+        self.notified_frame_rate = None
         self.encoding_started = datetime.datetime.now()
 
         if settings.UI_ENABLED:
@@ -132,21 +159,31 @@ class Recorder(object):
         if DEBUG:
             print "FPS: %s" % round(self.frame_rate)
 
-    def buffer_frame(self, frame):
-        (retval, jpg_frame) = cv2.imencode(".jpg", frame, (cv.CV_IMWRITE_JPEG_QUALITY, 50))
-        jpg_frame = jpg_frame.tostring()
-        self.current_jpg_frame = jpg_frame
-        self.frames[self.buffer_index] = jpg_frame
-        if self.buffer_index >= self.num_frames - 1:
-           self.buffer_index = 0
-        else:
-           self.buffer_index += 1
+    def buffer_frame(self, frame, copy=True):
+        """ Hand a raw frame to the encoder pool, it ends up in the buffer through store_jpg_frame """
+        self.encoder.submit(frame, copy=copy)
+
+    def store_jpg_frame(self, jpg_frames, timestamp):
+        """ Called by the encoder pool with the jpgs for every tier of a frame, in capture order """
+        archive_frame = jpg_frames['archive']
+        self.frames.append(archive_frame, timestamp)
+        if self.segment_encoder:
+            self.segment_encoder.add(archive_frame, timestamp)
+        preview_frame = jpg_frames.get('preview', archive_frame).tostring()
+        self.current_frame.update(preview_frame)
+        if not self.api.video_locked:
+            self.api.broadcaster.publish(preview_frame, timestamp=timestamp)
 
-    def get_ordered_buffer(self):
-        """ Returns buffer in correct frame order """
-        return copy.copy(self.frames[self.buffer_index:]+self.frames[:self.buffer_index])
+    def get_ordered_buffer(self, start_time=None, end_time=None):
+        """ Returns a snapshot of the buffer, optionally limited to a time range. Iterating over it gives the frames
+            in the correct order as views into the ring buffer, its report() says which frames were read.
+        """
+        return self.frames.snapshot(start_time, end_time)
 
     def loop(self):
+        if settings.THREADED_PIPELINE:
+            return self.pipeline_loop()
+
         while self.keep_running:
             self.update_frame_rate()
             self.handle_events()
@@ -154,32 +191,201 @@ class Recorder(object):
             if self.gui:
                 self.gui.update()
 
-    def _save_buffer_to_video(self):
+    def start_pipeline(self):
+        """ Capture, motion detection and buffering each get a thread, connected by bounded queues that drop
+            the oldest frame when full, so the capture thread never waits for the others.
+        """
+        analysis_stage = Stage("analysis", self.analyse_frame, on_error=self.stage_failed)
+        buffering_stage = Stage("buffering", self.buffer_pipeline_frame, on_error=self.stage_failed)
+        outputs = [analysis_stage, buffering_stage]
+        if self.ball_tracker:
+            outputs.append(Stage("tracking", self.track_frame, on_error=self.stage_failed))
+        capture_stage = SourceStage("capture", self.capture_pipeline_frame, outputs=outputs, on_error=self.stage_failed)
+        self.stages = [capture_stage] + outputs
+        for stage in self.stages:
+            stage.start()
+
+    def stage_failed(self, stage, error):
+        """ Stop the recorder, like the error would have without the pipeline, rather than go on without the stage """
+        self.log("Stopping, the %s stage failed: %s" % (stage.name, error))
+        self.keep_running = False
+
+    def stop_pipeline(self):
+        for stage in self.stages:
+            stage.stop()
+
+    def pipeline_loop(self):
+        """ Events and the gui are handled here, on the main thread, while the pipeline stages do the rest. """
+        self.start_pipeline()
+        shown_frame = None
+        try:
+            while self.keep_running:
+                self.handle_events()
+                frame = self.latest_frame
+                if frame is not shown_frame:
+                    shown_frame = frame
+                    self.ui_frame(frame)
+                if self.gui:
+                    self.gui.update()
+                if DEBUG:
+                    for stage in self.stages:
+                        print "%(name)s: %(fps).1f fps, %(ms_per_item).1f ms, %(dropped)s dropped" % stage.stats()
+                # Api commands cut the wait short
+                self.api.commands.wait(settings.UI_INTERVAL)
+        finally:
+            self.stop_pipeline()
+
+    def capture_pipeline_frame(self):
+        self.update_frame_rate()
+        frame = self.read_frame()
+        self.latest_frame = frame
+        return frame
+
+    def analyse_frame(self, frame):
+        if self.analysis_cadence.analyse(frame) and not self.ball_tracker:
+            # Without ball tracks, shots are found from motion on the table
+            motion_avg = self.motion_detector.motion_avg
+            self.shot_detector.update(motion_avg is not None and motion_avg > self.motion_detector.threshold, time.time())
+
+    def track_frame(self, frame):
+        if self.ball_tracker and self.ball_tracker.update(frame):
+            self.shot_detector.update(self.ball_tracker.moving(settings.SHOT_BALL_SPEED), time.time())
+
+    def buffer_pipeline_frame(self, frame):
+        if not self.api.video_locked:
+            # Pipeline frames aren't reused by the capture stage, so the encoder doesn't need a copy
+            self.buffer_frame(frame, copy=False)
+
+    def ui_frame(self, frame):
+        """ Called on the main thread with the newest captured frame """
+        self.debugging_output(frame)
+
+    def cv_image(self, frame_array):
+        """ Wrap an array in an IplImage header for the old cv api, without copying """
+        return cv.GetImage(cv.fromarray(frame_array))
+
+    def run_ffmpeg(self, job, arguments, output_file, frames=None):
+        """ Run ffmpeg at low priority, writing to a partial file that replaces output_file once it's done.
+            The partial file is named after the job, since a transcode and a save can work on the same file.
+        """
+        partial_file = os.path.join(os.path.dirname(output_file), "%s%s-%s" % (PARTIAL_PREFIX, job.id, os.path.basename(output_file)))
+        if frames is None:
+            cmdstring = ('ffmpeg', '-y', '-nostdin') + tuple(arguments) + (partial_file,)
+            p = subprocess.Popen(cmdstring, preexec_fn=lower_priority)
+        else:
+            cmdstring = ('ffmpeg', '-y') + tuple(arguments) + (partial_file,)
+            p = subprocess.Popen(cmdstring, stdin=subprocess.PIPE, preexec_fn=lower_priority)
+            for jpg_frame in frames:
+                p.stdin.write(jpg_frame)
+            p.stdin.close()
+        if p.wait():
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+            raise Exception("ffmpeg exited with %s" % p.returncode)
+        os.rename(partial_file, output_file)
+        return output_file
+
+    def _save_buffer_to_video(self, job):
+        """ Runs an encoding job from the scheduler, returns the file name once ffmpeg is done """
+        if job.kind == EncodeJob.TRANSCODE:
+            return self.run_ffmpeg(job, ('-i', job.source_file) + H264_OPTIONS, job.source_file)
+
+        self.api.notifications.publish("save", {'job': job.id, 'state': 'started', 'start_time': job.start_time, 'end_time': job.end_time})
+
         # Fixme: make shit configurable
-        output_file = datetime.datetime.now().strftime("pool-%Y-%m-%d %H:%M:%S.avi")
-        cmdstring = ('ffmpeg',
-                     '-r', '%d' % int(round(self.frame_rate)),
+        output_file = job.file_name()
+        if self.segment_encoder:
+            return self.save_segments_to_video(job, output_file)
+
+        arguments = ('-r', '%d' % int(round(self.frame_rate)),
                      '-f','image2pipe',
                      '-vcodec', 'mjpeg',
                      '-i', 'pipe:',
-                     '-c:v', 'libx264',
-                     '-preset', 'fast',
-                     '-crf', '23',
-                     output_file
-                     )
-
-        p = subprocess.Popen(cmdstring, stdin=subprocess.PIPE)
-        self.encoding_subprocesses.append(p)
-        for jpg_frame in self.get_ordered_buffer():
-            if jpg_frame is not None:
-                p.stdin.write(jpg_frame)
-        p.stdin.close()
-
-    def save_buffer_to_video(self):
-        t = threading.Thread(target=self._save_buffer_to_video)
-        t.daemon = True
-        t.start()
+                     ) + (MJPEG_COPY_OPTIONS if settings.INSTANT_SAVE else H264_OPTIONS)
+        snapshot = job.snapshot or self.get_ordered_buffer(job.start_time, job.end_time)
+        samples = snapshot.sample(settings.PREVIEW_FRAMES)
+        self.run_ffmpeg(job, arguments, output_file, snapshot)
+        job.coverage = snapshot.report()
+        self.thumbnails.add(output_file, samples)
+        return output_file
+
+    def save_segments_to_video(self, job, output_file):
+        """ Concatenate the already encoded segments covering the job into one video, without encoding anything """
+        self.segment_encoder.wait_for(job.end_time, timeout=2 * settings.SEGMENT_SECONDS)
+        segments = self.segment_encoder.acquire(job.start_time, job.end_time)
+        if not segments:
+            raise Exception("No encoded segments to save")
+        samples = (job.snapshot or self.get_ordered_buffer(job.start_time, job.end_time)).sample(settings.PREVIEW_FRAMES)
+        list_file = os.path.join(self.segment_encoder.directory, "concat-%s.txt" % job.id)
+        try:
+            self.segment_encoder.write_concat_list(segments, list_file)
+            self.run_ffmpeg(job, ('-f', 'concat', '-safe', '0', '-i', list_file, '-c', 'copy'), output_file)
+            self.thumbnails.add(output_file, samples)
+            return output_file
+        finally:
+            self.segment_encoder.release(segments)
+            os.remove(list_file)
+
+    def save_buffer_to_video(self, start_time=None, end_time=None):
+        """ Encode the buffered frames between start_time and end_time (timestamps, default everything) to a video.
+            Overlapping saves are merged by the scheduler, the job they ended up in is returned.
+        """
+        if start_time is None:
+            # Whatever is buffered now, not whatever is buffered once the job gets to run
+            buffered = self.get_ordered_buffer()
+            start_time = buffered.timestamps[0] if len(buffered) else time.time()
+        job = self.scheduler.save(start_time, end_time)
         self.start_encoding_animation()
+        return job
+
+    def save_requested(self, seconds=None, shots=None):
+        """ Save the last few seconds, or the last few shots, or the whole buffer """
+        now = time.time()
+        if shots:
+            shot_times = self.shot_detector.last_shots(shots, now)
+            if not shot_times:
+                self.log("No shots to save")
+                return
+            return self.save_buffer_to_video(*shot_times)
+        return self.save_buffer_to_video(start_time=now - seconds if seconds else None)
+
+    def motion_changed(self, event):
+        """ Called by the motion detector, on the analysis thread, when a motion event starts or ends """
+        self.api.notifications.publish("motion", {'active': event.end is None, 'event': event.id})
+
+    def notify_frame_rate(self):
+        if self.notified_frame_rate is None or abs(self.frame_rate - self.notified_frame_rate) >= settings.NOTIFY_FPS_CHANGE:
+            self.notified_frame_rate = self.frame_rate
+            self.api.notifications.publish("fps", {'fps': round(self.frame_rate, 1)})
+
+    def handle_finished_job(self, job):
+        """ Called from the recorder loop for every finished encoding job """
+        if job.kind == EncodeJob.SAVE:
+            self.api.notifications.publish("save", {'job': job.id, 'state': 'failed' if job.error else 'finished', 'file_name': job.output_file})
+            for command in self.pending_commands.pop(job.id, []):
+                if job.error:
+                    command.fail(job.error)
+                else:
+                    command.succeed(job.output_file)
+        if job.error:
+            self.log("Encoding job %s failed: %s" % (job.id, job.error))
+            return
+        self.log("Saved %s" % job.output_file)
+        if job.coverage:
+            self.log("Frames %(first_sequence)s to %(last_sequence)s (%(frames)s frames, %(start_time)s to %(end_time)s), "
+                     "%(skipped)s frames lost before reading, %(torn)s overwritten while reading" % job.coverage)
+        if job.kind == EncodeJob.TRANSCODE:
+            self.catalog.add(job.output_file)
+        if job.kind == EncodeJob.SAVE:
+            (start_time, end_time) = (job.coverage['start_time'], job.coverage['end_time']) if job.coverage else (job.start_time, job.end_time)
+            motion_events = self.motion_detector.motion_events.between(start_time, end_time) if start_time is not None and end_time is not None else None
+            self.catalog.add(job.output_file, created=job.created, start_time=start_time, end_time=end_time,
+                             frames=job.coverage['frames'] if job.coverage else None, motion_events=motion_events)
+            if self.ball_tracker:
+                tracks_file = os.path.join(settings.TRACKS_DIRECTORY, os.path.splitext(job.output_file)[0] + ".json")
+                self.ball_tracker.export(tracks_file, start_time, end_time)
+        if job.kind == EncodeJob.SAVE and settings.INSTANT_SAVE and settings.TRANSCODE_SAVES and not self.segment_encoder:
+            self.scheduler.transcode(job.output_file)
 
     def to_grayscale(self, image):
         tmp = cv.CreateImage(cv.GetSize(image), image.depth, 1)
@@ -373,25 +579,16 @@ class Recorder(object):
                 print "saving video"
                 self.save_buffer_to_video()
 
-        # Check on subprocesses
-        still_running = []
-        for p in self.encoding_subprocesses:
-            print p.poll()
-            if p.poll() is None:
-                still_running.append(p)
-        self.encoding_subprocesses = still_running
+        for job in self.scheduler.finished_jobs():
+            self.handle_finished_job(job)
+        self.notify_frame_rate()
 
-        if not self.encoding_subprocesses and datetime.datetime.now() - self.encoding_started > datetime.timedelta(seconds=1):
+        if not self.scheduler.busy(EncodeJob.SAVE) and datetime.datetime.now() - self.encoding_started > datetime.timedelta(seconds=1):
             self.stop_encoding_animation()
 
-        # Handle Api events
-        with self.api_lock:
-            for event in self.api.events:
-                if event == "save":
-                    recorder.save_buffer_to_video()
-                elif event == "quit":
-                    self.keep_running = False
-            self.api.events = []
+        # Handle Api commands
+        for command in self.api.commands.drain():
+            self.handle_command(command)
 
         if self.gui:
             event = self.gui.process_events()
@@ -407,15 +604,35 @@ class Recorder(object):
             else:
                 self.handle_custom_event(event)
 
+    def handle_command(self, command):
+        """ Run a command from the api. Saves are answered once their encoding job is done. """
+        try:
+            if command.name == "save":
+                job = self.save_requested(**command.kwargs)
+                if not job:
+                    return command.fail(Exception("Nothing to save"))
+                self.pending_commands.setdefault(job.id, []).append(command)
+            elif command.name == "quit":
+                self.keep_running = False
+                command.succeed()
+            else:
+                command.fail(Exception("Unknown command %s" % command.name))
+        except Exception, e:
+            command.fail(e)
+
     def debugging_output(self, frame):
         if DEBUG:
-            print "Buffer index: %s" % self.buffer_index
+            print "Buffered frames: %s" % len(self.frames)
         if SHOW_WINDOW:
             cv2.imshow("preview", frame)
 
     def capture_frame(self, as_array=True):
         raise NotImplementedError()
 
+    def read_frame(self):
+        """ Capture a frame as a BGR array that isn't reused by later captures, for the pipeline """
+        raise NotImplementedError()
+
     def handle_frame(self, *args, **kwargs):
         raise NotImplementedError()
 
@@ -442,11 +659,16 @@ class CVCaptureRecorder(Recorder):
         frame_array = numpy.asarray(frame[:,:])
         return frame_array
 
+    def read_frame(self):
+        # QueryFrame reuses its image for every frame
+        return self.capture_frame(as_array=True).copy()
+
     def handle_frame(self):
         frame = self.capture_frame(as_array=False)
         frame_array = numpy.asarray(frame[:,:])
 
-        self.motion_detector.update(frame)
+        self.analyse_frame(frame_array)
+        self.track_frame(frame_array)
         self.debugging_output(frame_array)
 
         if not self.api.video_locked:
@@ -465,6 +687,7 @@ class KinectRecorder(Recorder):
         # Helper images to display depth overlay over video feed
         self.gray_image = None
         self.temp_image = None
+        self.converter = FrameConverter()
 
         # Kinect loop settings
         self.dev = None
@@ -510,47 +733,41 @@ class KinectRecorder(Recorder):
         return depth
 
     def img_from_depth_frame(self, depth):
-        depth = depth.astype(numpy.uint8)
-        image = cv.CreateImageHeader((depth.shape[1], depth.shape[0]), cv.IPL_DEPTH_8U, 1)
-        cv.SetData(image, depth.tostring(), depth.dtype.itemsize * depth.shape[1])
-        return image
+        """ Wraps an already prettified depth frame in an IplImage, valid until the next depth conversion """
+        return self.cv_image(self.converter.depth_to_8bit(depth, pretty=False))
 
     def img_from_video_frame(self, video):
-        video = video[:, :, ::-1]  # RGB -> BGR
-        image = cv.CreateImageHeader((video.shape[1], video.shape[0]),
-                                     cv.IPL_DEPTH_8U,
-                                     3)
-        cv.SetData(image, video.tostring(),
-                   video.dtype.itemsize * 3 * video.shape[1])
-        return image
+        """ Converts a video frame to a BGR IplImage, valid until the next video conversion """
+        return self.cv_image(self.converter.video_to_bgr(video))
 
     def sync_get_depth_frame(self, as_array=False):
         depth, timestamp = freenect.sync_get_depth()
         if as_array:
             return depth
-        depth = self.pretty_depth(depth)
-        image = cv.CreateImageHeader((depth.shape[1], depth.shape[0]),
-                                     cv.IPL_DEPTH_8U,
-                                     1)
-        cv.SetData(image, depth.tostring(),
-                   depth.dtype.itemsize * depth.shape[1])
-        return image
+        return self.cv_image(self.converter.depth_to_8bit(depth))
 
     def sync_get_video_frame(self, as_array=False):
         video = freenect.sync_get_video()[0]
         if as_array:
             return video
-        video = video[:, :, ::-1]  # RGB -> BGR
-        image = cv.CreateImageHeader((video.shape[1], video.shape[0]),
-                                     cv.IPL_DEPTH_8U,
-                                     3)
-        cv.SetData(image, video.tostring(),
-                   video.dtype.itemsize * 3 * video.shape[1])
-        return image
+        return self.img_from_video_frame(video)
 
     def capture_frame(self, as_array=True):
         return self.sync_get_video_frame(as_array=as_array)
 
+    def read_frame(self):
+        # The frame is handed to other threads, so it gets its own array instead of the reused one
+        return self.converter.video_to_bgr(self.sync_get_video_frame(as_array=True), reuse=False)
+
+    def ui_frame(self, frame):
+        self.last_video_frame = self.cv_image(frame)
+        super(KinectRecorder, self).ui_frame(frame)
+
+        callbacks = copy.copy(self.post_video_callbacks)
+        self.post_video_callbacks = []
+        for callback in callbacks:
+            callback()
+
     def set_led(self, led_state):
         if not self.dev:
             print "no device set!"
@@ -584,14 +801,15 @@ class KinectRecorder(Recorder):
 
     def handle_video_frame(self, dev=None, data=None, timestamp=None):
         self.update_frame_rate()
-        #video_frame = numpy.asarray(data)
-        video_frame = self.img_from_video_frame(data)
-        frame_array = self.array(video_frame)
+        # Converted into a reused array, the encoder takes its own copy
+        frame_array = self.converter.video_to_bgr(data)
+        video_frame = self.cv_image(frame_array)
         self.last_video_frame = video_frame
         if frame_array.any() and not self.api.video_locked:
             self.buffer_frame(frame_array)
 
-        self.motion_detector.update(video_frame)
+        self.analyse_frame(frame_array)
+        self.track_frame(frame_array)
         self.debugging_output(frame_array)
 
         callbacks = copy.copy(self.post_video_callbacks)
@@ -616,9 +834,11 @@ class KinectRecorder(Recorder):
         self.post_depth_callbacks = []
 
     def loop(self):
-        """ Freenect has its own looping function, so we have to use that.
+        """ Freenect has its own looping function, so we have to use that, unless the threaded pipeline is used.
             Put general things that should happen in every frame into the "body" callback.
         """
+        if settings.THREADED_PIPELINE:
+            return self.pipeline_loop()
         freenect.runloop(depth=self.handle_depth_frame, video=self.handle_video_frame, body=self.kinect_body_callback)
 if __name__ == "__main__":
     if settings.RECORDER == 'cv':
@@ -0,0 +1,114 @@
+import struct
+import time
+
+from zope.interface import implementer
+from twisted.internet import reactor
+from twisted.internet.interfaces import IPushProducer
+
+from broadcast import multipart
+
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+
+
+@implementer(IPushProducer)
+class ReplayStream(object):
+    """ Plays the replay buffer as multipart jpgs, delay seconds behind live. Every frame is sent when its
+        timestamp comes up, so playback runs at the speed it was recorded. While the client is backed up
+        frames are skipped, once it catches up it gets the frame that is due.
+    """
+
+    def __init__(self, request, ring_buffer, seconds_ago):
+        self.request = request
+        self.ring_buffer = ring_buffer
+        self.paused = False
+        self.call = None
+
+        now = time.time()
+        oldest = ring_buffer.first_timestamp()
+        # Can't go back further than the oldest frame in the buffer
+        self.delay = min(seconds_ago, now - oldest) if oldest is not None else seconds_ago
+        # Timestamp of the last frame sent, the first frame is the last one before the starting point
+        self.last_timestamp = None
+
+    def start(self):
+        self.request.registerProducer(self, True)
+        self.request.notifyFinish().addBoth(lambda result: self.stopProducing())
+        self.send_due()
+
+    def send_due(self):
+        self.call = None
+        if not self.request:
+            return
+        play_time = time.time() - self.delay
+        if not self.paused:
+            due = self.ring_buffer.snapshot(self.last_timestamp, play_time)
+            frame = due.copy(len(due) - 1) if len(due) else None
+            if frame and (self.last_timestamp is None or frame[0] > self.last_timestamp):
+                (self.last_timestamp, jpg) = frame
+                self.request.write(multipart(jpg, "image/jpg"))
+
+        # Wait for the timestamp of the next frame, which might not have been captured yet if we're close to live
+        next_timestamp = self.ring_buffer.first_timestamp(play_time)
+        wait = next_timestamp - play_time if next_timestamp is not None else 0.05
+        self.call = reactor.callLater(min(max(wait, 0.005), 0.5), self.send_due)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        self.request = None
+        if self.call and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+
+def jpeg_size(jpg):
+    """ (width, height) from the start of frame marker of a jpg """
+    i = 2
+    while i + 9 <= len(jpg):
+        (marker, length) = struct.unpack(">HH", jpg[i:i + 4])
+        if marker in (0xFFC0, 0xFFC1, 0xFFC2, 0xFFC3):
+            (height, width) = struct.unpack(">HH", jpg[i + 5:i + 9])
+            return (width, height)
+        i += 2 + length
+    raise ValueError("No start of frame in jpg")
+
+
+def chunk(fourcc, data):
+    return fourcc + struct.pack("<I", len(data)) + data + ("\0" if len(data) % 2 else "")
+
+
+def riff_list(list_type, data, name="LIST"):
+    return name + struct.pack("<I", len(data) + 4) + list_type + data
+
+
+def mjpeg_avi(frames):
+    """ An avi with the (timestamp, jpg) frames as its video stream, without any encoding """
+    (width, height) = jpeg_size(frames[0][1])
+    duration = frames[-1][0] - frames[0][0]
+    frame_rate = (len(frames) - 1) / duration if duration > 0 else 25.0
+    largest = max(len(jpg) for (timestamp, jpg) in frames)
+
+    avih = struct.pack("<14I", int(round(1000000 / frame_rate)), int(largest * frame_rate), 0, AVIF_HASINDEX, len(frames),
+                       0, 1, largest, width, height, 0, 0, 0, 0)
+    strh = struct.pack("<4s4sIHHIIIIIIIIhhhh", "vids", "MJPG", 0, 0, 0, 0, 1000, int(round(frame_rate * 1000)), 0,
+                       len(frames), largest, 0xFFFFFFFF, 0, 0, 0, width, height)
+    strf = struct.pack("<IiiHH4sIiiII", 40, width, height, 1, 24, "MJPG", width * height * 3, 0, 0, 0, 0)
+    header = riff_list("hdrl", chunk("avih", avih) + riff_list("strl", chunk("strh", strh) + chunk("strf", strf)))
+
+    movi = []
+    index = []
+    # Index offsets count from the "movi" list type
+    offset = 4
+    for (timestamp, jpg) in frames:
+        data = chunk("00dc", jpg)
+        index.append(struct.pack("<4sIII", "00dc", AVIIF_KEYFRAME, offset, len(jpg)))
+        movi.append(data)
+        offset += len(data)
+
+    body = header + riff_list("movi", "".join(movi)) + chunk("idx1", "".join(index))
+    return riff_list("AVI ", body, name="RIFF")
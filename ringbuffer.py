@@ -0,0 +1,218 @@
+import time
+import numpy
+
+import settings
+
+
+class FrameRingBuffer(object):
+    """ Ring buffer for variable length frames (jpgs), stored back to back in one preallocated byte array.
+
+        Every frame gets an absolute byte position that only ever grows, the position modulo the size
+        of the byte array is its offset. A frame that doesn't fit in before the end of the array is
+        written at the start instead, and frames are dropped oldest first until the new one fits.
+
+        With a path, the frames and their positions, lengths and timestamps live in a memory mapped file
+        of fixed size instead of in memory, so long buffers don't need the RAM to match.
+
+        There's a single writer. Readers on other threads use snapshot(), which relies on the generation counter
+        (odd while an append is in progress) instead of a lock, so the writer never waits for them.
+    """
+
+    def __init__(self, num_frames, frame_size=settings.BUFFER_FRAME_SIZE, path=None):
+        self.num_frames = num_frames
+        self.size = num_frames * frame_size
+        self.path = path
+
+        if path:
+            # Four 8 byte index entries per frame, followed by the frame data
+            index_size = num_frames * 8
+            storage = numpy.memmap(path, dtype=numpy.uint8, mode='w+', shape=(4 * index_size + self.size,))
+            self.positions = storage[:index_size].view(numpy.int64)
+            self.lengths = storage[index_size:2 * index_size].view(numpy.int64)
+            self.timestamps = storage[2 * index_size:3 * index_size].view(numpy.float64)
+            self.sequences = storage[3 * index_size:4 * index_size].view(numpy.int64)
+            self.data = storage[4 * index_size:]
+        else:
+            self.data = numpy.zeros(self.size, dtype=numpy.uint8)
+            self.positions = numpy.zeros(num_frames, dtype=numpy.int64)
+            self.lengths = numpy.zeros(num_frames, dtype=numpy.int64)
+            self.timestamps = numpy.zeros(num_frames, dtype=numpy.float64)
+            self.sequences = numpy.zeros(num_frames, dtype=numpy.int64)
+
+        # Slot of the oldest frame and number of frames in the buffer
+        self.start = 0
+        self.count = 0
+        # Absolute position the next frame will be written to
+        self.head = 0
+        # Sequence number of the next frame, counting every frame ever appended
+        self.next_sequence = 0
+        self.generation = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """ Iterates over the frames from oldest to newest as views into the byte array, nothing is copied. """
+        for slot in self.slots():
+            yield self.frame(slot)
+
+    def slots(self, start_time=None, end_time=None):
+        """ Slots of the frames from oldest to newest, optionally only those with timestamps in [start_time, end_time] """
+        slots = (self.start + numpy.arange(self.count)) % self.num_frames
+        if start_time is not None or end_time is not None:
+            timestamps = self.timestamps[slots]
+            first = numpy.searchsorted(timestamps, start_time, 'left') if start_time is not None else 0
+            last = numpy.searchsorted(timestamps, end_time, 'right') if end_time is not None else len(slots)
+            slots = slots[first:last]
+        return slots
+
+    def between(self, start_time=None, end_time=None):
+        """ Like iterating over the buffer, but only for frames with timestamps in [start_time, end_time] """
+        for slot in self.slots(start_time, end_time):
+            yield self.frame(slot)
+
+    def snapshot(self, start_time=None, end_time=None):
+        """ Freeze the range of frames in the buffer (optionally with timestamps in [start_time, end_time])
+            without stopping the writer. Only the index is copied, frames are read from the buffer later.
+        """
+        def read():
+            slots = self.slots(start_time, end_time)
+            return BufferSnapshot(self, self.sequences[slots], self.positions[slots],
+                                  self.lengths[slots], self.timestamps[slots])
+        return self.read_index(read)
+
+    def first_timestamp(self, start_time=None):
+        """ Timestamp of the oldest frame (optionally the oldest at or after start_time), None if there isn't one """
+        def read():
+            slots = self.slots(start_time, None)
+            return self.timestamps[slots[0]] if len(slots) else None
+        return self.read_index(read)
+
+    def read_index(self, read):
+        """ Call read until it ran without the writer changing the index in the meantime """
+        while True:
+            generation = self.generation
+            if generation % 2:
+                time.sleep(0)
+                continue
+            result = read()
+            if self.generation == generation:
+                return result
+
+    def intact(self, position):
+        """ Is the frame written at position still there, or has it been overwritten since """
+        return position >= self.head - self.size
+
+    def frame(self, slot):
+        offset = self.positions[slot] % self.size
+        return self.data[offset:offset + self.lengths[slot]]
+
+    def newest(self):
+        if not self.count:
+            return None
+        return self.frame((self.start + self.count - 1) % self.num_frames)
+
+    def append(self, frame, timestamp=None):
+        """ Add a frame, either a string or an array like the one cv2.imencode returns. """
+        if isinstance(frame, str):
+            frame = numpy.frombuffer(frame, dtype=numpy.uint8)
+        else:
+            frame = frame.reshape(-1)
+
+        length = len(frame)
+        if length > self.size:
+            raise ValueError("Frame of %s bytes doesn't fit in a buffer of %s bytes" % (length, self.size))
+
+        self.generation += 1
+
+        position = self.head
+        if position % self.size + length > self.size:
+            position += self.size - position % self.size
+        # Moved before anything is overwritten, so readers checking intact() never see a frame being written
+        self.head = position + length
+
+        # Drop frames that are about to be overwritten
+        while self.count and (self.count == self.num_frames or self.positions[self.start] < self.head - self.size):
+            self.start = (self.start + 1) % self.num_frames
+            self.count -= 1
+
+        slot = (self.start + self.count) % self.num_frames
+        offset = position % self.size
+        self.data[offset:offset + length] = frame
+        self.positions[slot] = position
+        self.lengths[slot] = length
+        self.timestamps[slot] = timestamp if timestamp is not None else time.time()
+        self.sequences[slot] = self.next_sequence
+        self.next_sequence += 1
+        self.count += 1
+
+        self.generation += 1
+
+
+class BufferSnapshot(object):
+    """ A fixed range of frames in a ring buffer. Iterating yields views into the buffer.
+
+        Frames the writer overwrote before they were read are skipped. A frame overwritten while the
+        caller was still using it is torn, which is only noticed afterwards, so it is reported as such.
+    """
+
+    def __init__(self, ring_buffer, sequences, positions, lengths, timestamps):
+        self.ring_buffer = ring_buffer
+        self.sequences = sequences
+        self.positions = positions
+        self.lengths = lengths
+        self.timestamps = timestamps
+
+        # Sequence numbers and timestamps of the frames that were read intact
+        self.read_sequences = []
+        self.read_timestamps = []
+        self.skipped = []
+        self.torn = []
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def __iter__(self):
+        ring_buffer = self.ring_buffer
+        for i in range(len(self.sequences)):
+            position = self.positions[i]
+            if not ring_buffer.intact(position):
+                self.skipped.append(self.sequences[i])
+                continue
+
+            offset = position % ring_buffer.size
+            yield ring_buffer.data[offset:offset + self.lengths[i]]
+
+            if ring_buffer.intact(position):
+                self.read_sequences.append(self.sequences[i])
+                self.read_timestamps.append(self.timestamps[i])
+            else:
+                self.torn.append(self.sequences[i])
+
+    def sample(self, count):
+        """ (timestamp, copy of the frame) for up to count frames spread evenly over the snapshot. Doesn't count as
+            reading them for the report. Frames overwritten in the meantime are left out.
+        """
+        if not len(self.sequences):
+            return []
+        samples = [self.copy(i) for i in numpy.unique(numpy.linspace(0, len(self.sequences) - 1, count).astype(int))]
+        return [sample for sample in samples if sample]
+
+    def copy(self, i):
+        """ (timestamp, copy of the frame) for the i-th frame of the snapshot, None if it was overwritten """
+        position = self.positions[i]
+        offset = position % self.ring_buffer.size
+        frame = self.ring_buffer.data[offset:offset + self.lengths[i]].tostring()
+        return (self.timestamps[i], frame) if self.ring_buffer.intact(position) else None
+
+    def report(self):
+        """ What was actually read: sequence numbers and timestamps of the first and last frame, and the damage """
+        return {
+            'frames': len(self.read_sequences),
+            'first_sequence': self.read_sequences[0] if self.read_sequences else None,
+            'last_sequence': self.read_sequences[-1] if self.read_sequences else None,
+            'start_time': self.read_timestamps[0] if self.read_timestamps else None,
+            'end_time': self.read_timestamps[-1] if self.read_timestamps else None,
+            'skipped': len(self.skipped),
+            'torn': len(self.torn),
+        }
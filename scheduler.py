@@ -0,0 +1,159 @@
+import threading
+import datetime
+import Queue
+import itertools
+import os
+import time
+
+import settings
+
+
+def lower_priority():
+    """ Use as preexec_fn for encoder subprocesses, so they don't compete with capture for the cpu """
+    os.nice(settings.ENCODING_NICENESS)
+
+
+class EncodeJob(object):
+    SAVE = 'save'
+    TRANSCODE = 'transcode'
+
+    def __init__(self, job_id, start_time=None, end_time=None, kind=SAVE, source_file=None):
+        self.id = job_id
+        self.kind = kind
+        self.start_time = start_time
+        self.end_time = end_time
+        # File to transcode for transcode jobs
+        self.source_file = source_file
+        self.created = time.time()
+        # Number of saves that ended up in this job
+        self.requests = 1
+        self.started = None
+        self.finished = None
+        self.output_file = None
+        self.error = None
+        # Which buffered frames ended up in the video, see BufferSnapshot.report
+        self.coverage = None
+        # Buffer snapshot of the job's window, taken when the save was requested
+        self.snapshot = None
+
+    def file_name(self, prefix="pool-", extension=".avi"):
+        """ Name of the video a save job writes. Saves requested in the same second get separate jobs, so the job
+            id goes in as well.
+        """
+        return datetime.datetime.fromtimestamp(self.created).strftime(prefix + "%Y-%m-%d %H:%M:%S") + "-%s%s" % (self.id, extension)
+
+    def overlaps(self, start_time, end_time):
+        """ A start time of None means from the start of the buffer """
+        return (start_time is None or self.end_time is None or start_time <= self.end_time) and \
+            (self.start_time is None or end_time is None or self.start_time <= end_time)
+
+    def merge(self, start_time, end_time):
+        self.start_time = None if start_time is None or self.start_time is None else min(self.start_time, start_time)
+        self.end_time = max(self.end_time, end_time)
+        self.requests += 1
+
+
+class EncodeScheduler(object):
+    """ Runs save jobs on their own threads, at most max_jobs at a time.
+
+        A save that overlaps a job that hasn't started yet is merged into it. A save that lies entirely within
+        a running job is covered by that job, anything reaching further gets a job of its own that later saves
+        can merge into.
+        Transcodes have their own max_transcodes slots, so a long transcode never holds up a save, and only
+        start when no saves are waiting.
+        With a snapshot callable, every save job gets job.snapshot = snapshot(start_time, end_time) as soon as
+        it's requested (again whenever another save is merged in), so the frames are pinned down before the
+        job gets to run. Finished jobs are collected by the recorder loop through finished_jobs().
+    """
+
+    def __init__(self, run_job, max_jobs=settings.MAX_ENCODING_JOBS, max_transcodes=settings.MAX_TRANSCODE_JOBS, snapshot=None):
+        self.run_job = run_job
+        self.max_jobs = max_jobs
+        self.max_transcodes = max_transcodes
+        self.snapshot = snapshot
+
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.queued = []
+        self.running = []
+        self.finished = Queue.Queue()
+
+    def save(self, start_time=None, end_time=None):
+        end_time = end_time if end_time is not None else time.time()
+        with self.lock:
+            for job in self.queued:
+                if job.kind == EncodeJob.SAVE and job.overlaps(start_time, end_time):
+                    job.merge(start_time, end_time)
+                    self.take_snapshot(job)
+                    return job
+
+            for job in self.running:
+                # The running job's window is fixed, so it only covers saves that don't reach past its end
+                if job.kind == EncodeJob.SAVE and job.overlaps(start_time, end_time) and end_time <= job.end_time:
+                    job.requests += 1
+                    return job
+
+            job = EncodeJob(next(self.ids), start_time, end_time)
+            self.take_snapshot(job)
+            return self.queue(job)
+
+    def take_snapshot(self, job):
+        """ Needs the lock, so the job can't start in the meantime """
+        if self.snapshot:
+            job.snapshot = self.snapshot(job.start_time, job.end_time)
+
+    def transcode(self, source_file):
+        with self.lock:
+            return self.queue(EncodeJob(next(self.ids), kind=EncodeJob.TRANSCODE, source_file=source_file))
+
+    def queue(self, job):
+        """ Needs the lock """
+        self.queued.append(job)
+        self.start_jobs()
+        return job
+
+    def running_count(self, kind):
+        return len([job for job in self.running if job.kind == kind])
+
+    def start_jobs(self):
+        """ Start queued jobs while there's room, saves first, needs the lock """
+        while True:
+            saves = [job for job in self.queued if job.kind == EncodeJob.SAVE]
+            transcodes = [job for job in self.queued if job.kind == EncodeJob.TRANSCODE]
+            if saves and self.running_count(EncodeJob.SAVE) < self.max_jobs:
+                job = saves[0]
+            elif transcodes and not saves and self.running_count(EncodeJob.TRANSCODE) < self.max_transcodes:
+                job = transcodes[0]
+            else:
+                break
+            self.queued.remove(job)
+            job.started = time.time()
+            self.running.append(job)
+            t = threading.Thread(target=self.run, args=(job,))
+            t.daemon = True
+            t.start()
+
+    def run(self, job):
+        try:
+            job.output_file = self.run_job(job)
+        except Exception, e:
+            job.error = e
+        job.finished = time.time()
+
+        with self.lock:
+            self.running.remove(job)
+            self.start_jobs()
+        self.finished.put(job)
+
+    def busy(self, kind=None):
+        """ Are there jobs queued or running, optionally only of one kind """
+        return any(kind is None or job.kind == kind for job in self.queued + self.running)
+
+    def finished_jobs(self):
+        """ Jobs that finished since the last call """
+        jobs = []
+        while True:
+            try:
+                jobs.append(self.finished.get_nowait())
+            except Queue.Empty:
+                return jobs
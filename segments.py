@@ -0,0 +1,153 @@
+import threading
+import subprocess
+import Queue
+import os
+
+import settings
+from scheduler import lower_priority
+
+
+class Segment(object):
+    def __init__(self, path, start_time):
+        self.path = path
+        self.start_time = start_time
+        self.end_time = start_time
+        self.frames = 0
+        self.process = None
+        # Saves currently concatenating this segment
+        self.in_use = 0
+        self.expired = False
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SegmentEncoder(object):
+    """ Keeps encoding the live feed into short h264 segments, so saving just means concatenating segments.
+
+        Every segment is its own low priority ffmpeg process, fed from a queue on a separate thread so the
+        encoder pool never waits on ffmpeg. Only the newest max_segments finished segments are kept on disk.
+    """
+
+    def __init__(self, frame_rate, directory=settings.SEGMENT_DIRECTORY, segment_seconds=settings.SEGMENT_SECONDS,
+                 max_segments=settings.SEGMENT_COUNT, queue_size=settings.SEGMENT_QUEUE_SIZE):
+        # Callable returning the current frame rate
+        self.frame_rate = frame_rate
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.queue = Queue.Queue(queue_size)
+        self.lock = threading.Condition()
+        # Finished segments, oldest first
+        self.segments = []
+        self.current = None
+        self.segment_number = 0
+        self.dropped_frames = 0
+
+        t = threading.Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def add(self, jpg_frame, timestamp):
+        """ Called with every archive jpg, never blocks. The jpg must not be changed afterwards. """
+        try:
+            self.queue.put_nowait((jpg_frame, timestamp))
+        except Queue.Full:
+            self.dropped_frames += 1
+
+    def run(self):
+        while True:
+            (jpg_frame, timestamp) = self.queue.get()
+            if self.current and timestamp - self.current.start_time >= self.segment_seconds:
+                self.finish_segment(self.current)
+                self.current = None
+            if not self.current:
+                self.current = self.start_segment(timestamp)
+
+            try:
+                self.current.process.stdin.write(jpg_frame)
+            except IOError:
+                # ffmpeg died, the next frame starts a new segment
+                self.current.process.stdin.close()
+                self.current = None
+                continue
+            self.current.end_time = timestamp
+            self.current.frames += 1
+
+    def start_segment(self, timestamp):
+        self.segment_number += 1
+        segment = Segment(os.path.join(self.directory, "segment-%06d.ts" % self.segment_number), timestamp)
+        cmdstring = ('ffmpeg', '-y',
+                     '-loglevel', 'error',
+                     '-r', '%d' % max(1, int(round(self.frame_rate()))),
+                     '-f', 'image2pipe',
+                     '-vcodec', 'mjpeg',
+                     '-i', 'pipe:',
+                     '-c:v', 'libx264',
+                     '-preset', 'veryfast',
+                     '-crf', '23',
+                     segment.path
+                     )
+        segment.process = subprocess.Popen(cmdstring, stdin=subprocess.PIPE, preexec_fn=lower_priority)
+        return segment
+
+    def finish_segment(self, segment):
+        """ Close the segment's input and wait for ffmpeg on another thread, so the next segment can start """
+        segment.process.stdin.close()
+        t = threading.Thread(target=self.wait_for_segment, args=(segment,))
+        t.daemon = True
+        t.start()
+
+    def wait_for_segment(self, segment):
+        if segment.process.wait():
+            segment.remove()
+            return
+
+        with self.lock:
+            # ffmpeg processes can finish out of order
+            index = len(self.segments)
+            while index and self.segments[index - 1].start_time > segment.start_time:
+                index -= 1
+            self.segments.insert(index, segment)
+            self.lock.notify_all()
+            while len(self.segments) > self.max_segments:
+                old_segment = self.segments.pop(0)
+                old_segment.expired = True
+                if not old_segment.in_use:
+                    old_segment.remove()
+
+    def wait_for(self, end_time, timeout):
+        """ Wait until the frames up to end_time are in finished segments, or the timeout runs out """
+        with self.lock:
+            waited = 0
+            while (not self.segments or self.segments[-1].end_time < end_time) and waited < timeout:
+                self.lock.wait(0.1)
+                waited += 0.1
+
+    def acquire(self, start_time=None, end_time=None):
+        """ Finished segments overlapping [start_time, end_time], kept on disk until they are released """
+        with self.lock:
+            segments = [segment for segment in self.segments
+                        if (start_time is None or segment.end_time >= start_time) and
+                           (end_time is None or segment.start_time <= end_time)]
+            for segment in segments:
+                segment.in_use += 1
+            return segments
+
+    def release(self, segments):
+        with self.lock:
+            for segment in segments:
+                segment.in_use -= 1
+                if segment.expired and not segment.in_use:
+                    segment.remove()
+
+    def write_concat_list(self, segments, path):
+        """ File list for ffmpeg's concat demuxer """
+        with open(path, "w") as f:
+            for segment in segments:
+                f.write("file '%s'\n" % os.path.abspath(segment.path))
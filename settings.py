@@ -5,17 +5,90 @@ SHOW_WINDOW = False
 # Recorder 
 RECORDER = 'kinect' # cv or kinect
 LIMIT_FPS = 20
+THREADED_PIPELINE = True # Capture, motion detection and buffering on separate threads
+PIPELINE_QUEUE_SIZE = 2
 BUFFER_LENGTH = 30*25
+BUFFER_FRAME_SIZE = 96*1024 # Bytes reserved per buffered jpg, on average
+BUFFER_FILE = None # Path for a memory mapped buffer file, for buffers too long to keep in RAM
+
+# Encoding
+# Jpg tiers every frame is encoded to, as (width or None for full resolution, quality).
+# The archive tier goes into the replay buffer, the preview tier is served by /stream and /current.
+ENCODE_TIERS = {
+	'archive': (None, 80),
+	'preview': (320, 40),
+}
+ENCODER_WORKERS = 2 # 0 to encode on the capture thread
+ENCODER_QUEUE_SIZE = 4
+ENCODER_DROP_POLICY = 'oldest' # oldest, newest or block
+MAX_ENCODING_JOBS = 1 # Videos encoded at the same time, more saves wait their turn
+MAX_TRANSCODE_JOBS = 1 # Background transcodes at the same time, on top of the saves
+ENCODING_NICENESS = 10
+INSTANT_SAVE = True # Save the buffered jpgs as they are, without transcoding
+TRANSCODE_SAVES = True # Transcode instant saves to h264 in the background, replacing the original file
+
+# Continuous encoding of the live feed into short h264 segments, saves then just concatenate segments
+SEGMENTED_ENCODING = False
+SEGMENT_DIRECTORY = "segments"
+SEGMENT_SECONDS = 2
+SEGMENT_COUNT = 15 # Number of finished segments kept, should cover the buffer length
+SEGMENT_QUEUE_SIZE = 50 # Frames waiting for the segment encoder before frames get dropped
+
+# Recordings
+RECORDING_CATALOG_DB = "recordings.sqlite" # None to keep the catalog in memory only
+VIDEOS_PER_PAGE = 50
+THUMBNAIL_DIRECTORY = "thumbnails"
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_CACHE_BYTES = 50 * 1024 * 1024 # Least recently used thumbnails are removed beyond this
+PREVIEW_FRAMES = 5 # Frames in the preview strip of a recording
+
+# Api
+NOTIFY_FPS_CHANGE = 2 # Frame rate change that is pushed to /notifications clients
+STREAM_SEND_BUFFER = 64 * 1024 # Socket send buffer of /stream clients, small so slow clients skip frames early
 
 # UI 
 UI_ENABLED = False
 UI_FULLSCREEN = True
 UI_RESOLUTION = None # None for display resolution or tuple (x,y)
+UI_INTERVAL = 0.02 # Seconds between gui updates and event handling with the threaded pipeline
 
 # Motion detection
 MOTION_THRESHOLD = 2
 MOTION_EVENT_GAP = 1
 MOTION_TIMEOUT = 30
+MOTION_ANALYSIS_SIZE = (160, 120) # Frames are scaled down to this for motion detection
+MOTION_BLUR_SIZE = 3 # Gaussian blur kernel size, on the scaled down frame
+MOTION_IDLE_AFTER = 300 # Seconds without recent motion before motion detection drops to the idle rate
+MOTION_IDLE_RATE = 2 # Frames per second analysed while idle
+MOTION_WAKE_THRESHOLD = 25 # Change of a grid pixel that counts for the cheap check while idle
+MOTION_WAKE_POINTS = 3 # Changed grid pixels that switch back to analysing every frame
+MOTION_EVENT_DB = "motion_events.sqlite" # None to keep events in memory only
+MOTION_EVENT_TAIL = 1000 # Newest events kept in memory for fast queries
+# Polygons with coordinates from 0 to 1 relative to the frame. When there are zones, only motion
+# in zones that aren't ignored counts, and /active/zones reports every zone separately.
+MOTION_ZONES = {
+	#'table': {'polygon': [(0.1, 0.2), (0.9, 0.2), (0.9, 0.8), (0.1, 0.8)]},
+	#'doorway': {'polygon': [(0.9, 0), (1, 0), (1, 1), (0.9, 1)], 'ignore': True},
+}
+
+# Ball tracking
+BALL_TRACKING = False
+TABLE_POLYGON = None # Table surface with coordinates from 0 to 1 relative to the frame, None for the whole frame
+TRACKING_ANALYSIS_SIZE = (320, 240)
+TRACKING_BUDGET_MS = 5 # Frames are skipped after a frame took longer than this
+TRACKING_HISTORY_SECONDS = 60 # Tracks kept for exporting with saved clips, should cover the buffer length
+TRACKS_DIRECTORY = "tracks" # Exported tracks, kept apart from the recordings so they are never taken for one
+TRACKING_COLOUR_THRESHOLD = 40 # Difference from the cloth colour for a pixel to be part of a ball
+TRACKING_BALL_RADIUS = (2, 8) # Ball radius range in pixels on the analysis frame
+TRACKING_MAX_DISTANCE = 0.1 # Furthest a ball can be from its predicted position, relative to the frame width
+TRACKING_MAX_MISSES = 5 # Frames a ball can go undetected before its track is dropped
+TRACKING_CLOTH_INTERVAL = 100 # Frames between updates of the cloth colour
+
+# Shots
+SHOT_REST_SECONDS = 2 # Everything has to be still this long for a shot to end
+SHOT_BALL_SPEED = 0.05 # Ball speed that counts as moving with ball tracking, in frame widths per second
+SHOT_PADDING_SECONDS = 1 # Added before and after shots when saving them
+SHOT_INDEX_LENGTH = 100 # Most recent shots kept in the index
 
 # Kinect
 TOUCH_LAYERS = {
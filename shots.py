@@ -0,0 +1,54 @@
+import collections
+import threading
+
+import settings
+
+
+class Shot(object):
+    def __init__(self, start_time):
+        self.start_time = start_time
+        # Last time anything was moving
+        self.last_movement = start_time
+        self.end_time = None
+
+    def state(self):
+        return {'start_time': self.start_time, 'end_time': self.end_time}
+
+
+class ShotDetector(object):
+    """ Splits play into shots: a shot starts when something on the table starts moving, and ends once
+        everything has been at rest for rest_seconds. Fed with ball tracks when tracking is on, motion otherwise.
+        Keeps an index of the most recent shots, so saves can cover just the last few shots.
+    """
+
+    def __init__(self, rest_seconds=settings.SHOT_REST_SECONDS, index_length=settings.SHOT_INDEX_LENGTH):
+        self.rest_seconds = rest_seconds
+        self.lock = threading.Lock()
+        # Finished shots, oldest first
+        self.shots = collections.deque(maxlen=index_length)
+        self.current = None
+
+    def update(self, moving, timestamp):
+        with self.lock:
+            if moving:
+                if not self.current:
+                    self.current = Shot(timestamp)
+                self.current.last_movement = timestamp
+            elif self.current and timestamp - self.current.last_movement >= self.rest_seconds:
+                self.current.end_time = self.current.last_movement
+                self.shots.append(self.current)
+                self.current = None
+
+    def last_shots(self, count, now):
+        """ Start and end time covering the last count shots, including one still going on (which ends now) """
+        with self.lock:
+            shots = list(self.shots) + ([self.current] if self.current else [])
+        shots = shots[-count:]
+        if not shots:
+            return None
+        padding = settings.SHOT_PADDING_SECONDS
+        return (shots[0].start_time - padding, shots[-1].end_time + padding if shots[-1].end_time else now)
+
+    def index(self):
+        with self.lock:
+            return [shot.state() for shot in self.shots] + ([self.current.state()] if self.current else [])
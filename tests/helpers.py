@@ -0,0 +1,52 @@
+from twisted.internet import defer
+
+
+class FakeRequest(object):
+    """ Just enough of a twisted request for the api's helpers: records what's written and set on it, and
+        notifyFinish() fires on finish(), or on disconnect by calling finished.callback.
+    """
+    transport = None
+
+    def __init__(self, request_headers=None, method="GET"):
+        self.method = method
+        self.request_headers = request_headers or {}
+        self.code = 200
+        self.headers = {}
+        self.written = []
+        self.producer = None
+        self.finished = defer.Deferred()
+        self.done = False
+
+    def getHeader(self, name):
+        return self.request_headers.get(name.lower())
+
+    def getClientIP(self):
+        return "127.0.0.1"
+
+    def setHeader(self, name, value):
+        self.headers[name] = value
+
+    def setResponseCode(self, code):
+        self.code = code
+
+    def write(self, data):
+        self.written.append(data)
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def notifyFinish(self):
+        return self.finished
+
+    def finish(self):
+        self.done = True
+        self.finished.callback(None)
+
+    def run(self):
+        """ Pull chunks like twisted does until a pull producer is done """
+        while self.producer:
+            self.producer.resumeProducing()
+        return "".join(self.written)
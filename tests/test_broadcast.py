@@ -0,0 +1,47 @@
+import unittest
+
+from broadcast import MjpegBroadcaster
+from helpers import FakeRequest
+
+
+class MjpegBroadcasterTests(unittest.TestCase):
+    def setUp(self):
+        self.broadcaster = MjpegBroadcaster()
+
+    def publish(self, content, timestamp):
+        self.broadcaster.publish(content, timestamp=timestamp)
+        self.broadcaster.fan_out(*self.broadcaster.latest)
+
+    def test_new_clients_get_the_latest_frame(self):
+        self.broadcaster.publish("frame 1", timestamp=1)
+        request = FakeRequest()
+        self.broadcaster.subscribe(request)
+        self.assertEquals(len(request.written), 1)
+        self.assertTrue("frame 1" in request.written[0])
+
+    def test_slow_clients_skip_to_the_newest_frame(self):
+        fast = FakeRequest()
+        slow = FakeRequest()
+        self.broadcaster.subscribe(fast)
+        self.broadcaster.subscribe(slow)
+
+        slow.producer.pauseProducing()
+        for i in range(5):
+            self.publish("frame %s" % i, i)
+        self.assertEquals(len(fast.written), 5)
+        self.assertEquals(len(slow.written), 0)
+
+        stats = dict((id(client.request), stats) for (client, stats) in zip(self.broadcaster.clients, self.broadcaster.stats()))
+        self.assertEquals(stats[id(slow)]['frames_skipped'], 4)
+        self.assertEquals(stats[id(slow)]['lag'], None)
+
+        slow.producer.resumeProducing()
+        self.assertEquals(len(slow.written), 1)
+        self.assertTrue("frame 4" in slow.written[0])
+        self.assertEquals(self.broadcaster.stats()[1]['lag'], 0)
+
+    def test_finished_clients_are_removed(self):
+        request = FakeRequest()
+        self.broadcaster.subscribe(request)
+        request.finished.callback(None)
+        self.assertEquals(self.broadcaster.clients, [])
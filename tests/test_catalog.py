@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from catalog import RecordingCatalog
+
+
+class RecordingCatalogTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for (i, file_name) in enumerate(["pool-old.avi", "partial-pool-new.avi", "notes.txt"]):
+            self.write(file_name, "x" * 10)
+            os.utime(os.path.join(self.directory, file_name), (1000 + i, 1000 + i))
+        self.catalog = RecordingCatalog(path=None, directory=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, file_name, content):
+        with open(os.path.join(self.directory, file_name), "w") as f:
+            f.write(content)
+
+    def test_existing_recordings_are_picked_up(self):
+        (recordings, total) = self.catalog.page()
+        self.assertEquals(total, 1)
+        self.assertEquals(recordings[0]['file_name'], "pool-old.avi")
+        self.assertEquals(recordings[0]['created'], 1000)
+        self.assertEquals(recordings[0]['duration'], None)
+
+    def test_sync_skips_other_files_with_the_prefix(self):
+        self.write("pool-old.avi.tracks.json", "[]")
+        self.write("pool-old.jpg", "")
+        self.catalog.sync()
+        (recordings, total) = self.catalog.page()
+        self.assertEquals([recording['file_name'] for recording in recordings], ["pool-old.avi"])
+
+    def test_add_and_update(self):
+        self.write("pool-new.avi", "x" * 100)
+        recording_id = self.catalog.add("pool-new.avi", created=2000, start_time=10, end_time=40, frames=750, motion_events=[(12, 20)])
+        recording = self.catalog.latest()
+        self.assertEquals(recording['id'], recording_id)
+        self.assertEquals((recording['size'], recording['duration'], recording['frames']), (100, 30, 750))
+        self.assertEquals(recording['motion_events'], [[12, 20]])
+
+        # Transcoding replaces the file, only the size changes
+        self.write("pool-new.avi", "x" * 50)
+        self.assertEquals(self.catalog.add("pool-new.avi"), recording_id)
+        recording = self.catalog.get(recording_id)
+        self.assertEquals((recording['size'], recording['frames'], recording['created']), (50, 750, 2000))
+
+    def test_pages(self):
+        for i in range(5):
+            self.write("pool-%s.avi" % i, "")
+            self.catalog.add("pool-%s.avi" % i, created=2000 + i)
+        (recordings, total) = self.catalog.page(1, 2)
+        self.assertEquals(total, 6)
+        self.assertEquals([recording['file_name'] for recording in recordings], ["pool-2.avi", "pool-1.avi"])
+
+    def test_deleted_recordings_are_forgotten(self):
+        os.remove(os.path.join(self.directory, "pool-old.avi"))
+        self.catalog.sync()
+        self.assertEquals(self.catalog.page()[1], 0)
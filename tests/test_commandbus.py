@@ -0,0 +1,28 @@
+import threading
+import time
+import unittest
+
+from commandbus import CommandBus
+
+
+class CommandBusTests(unittest.TestCase):
+    def test_identical_commands_are_coalesced(self):
+        bus = CommandBus()
+        for i in range(10):
+            bus.send("save", seconds=30)
+        bus.send("save", seconds=10)
+        bus.send("quit")
+
+        commands = bus.drain()
+        self.assertEquals([(command.name, command.kwargs) for command in commands],
+                          [("save", {'seconds': 30}), ("save", {'seconds': 10}), ("quit", {})])
+        self.assertEquals(len(commands[0].coalesced), 9)
+        self.assertEquals(bus.drain(), [])
+
+    def test_sending_wakes_the_loop(self):
+        bus = CommandBus()
+        threading.Timer(0.05, lambda: bus.send("quit")).start()
+        started = time.time()
+        bus.wait(5)
+        self.assertTrue(time.time() - started < 1)
+        self.assertEquals(len(bus.drain()), 1)
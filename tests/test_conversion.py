@@ -0,0 +1,19 @@
+import unittest
+import numpy
+
+from conversion import FrameConverter
+
+class ConversionTests(unittest.TestCase):
+    def test_video_to_bgr_reuses_output(self):
+        converter = FrameConverter()
+        video = numpy.zeros((4, 4, 3), dtype=numpy.uint8)
+        video[:, :, 0] = 255
+        bgr = converter.video_to_bgr(video)
+        self.assertEquals(list(bgr[0][0]), [0, 0, 255])
+        self.assertTrue(converter.video_to_bgr(video) is bgr)
+        self.assertFalse(converter.video_to_bgr(video, reuse=False) is bgr)
+
+    def test_depth_to_8bit(self):
+        converter = FrameConverter()
+        depth = numpy.array([[0, 400, 2047]], dtype=numpy.uint16)
+        self.assertEquals(converter.depth_to_8bit(depth).tolist(), [[0, 100, 255]])
@@ -0,0 +1,65 @@
+import unittest
+import threading
+import time
+import numpy
+import cv2
+
+from currentframe import CurrentFrame
+
+
+class CurrentFrameTests(unittest.TestCase):
+    def jpg(self, value):
+        return cv2.imencode(".jpg", numpy.ones((240, 320, 3), dtype=numpy.uint8) * value)[1].tostring()
+
+    def test_etag_changes_with_every_frame(self):
+        current = CurrentFrame()
+        self.assertEquals(current.get(), None)
+        current.update(self.jpg(10))
+        (etag, jpg) = current.get()
+        self.assertEquals(current.get(), (etag, jpg))
+        current.update(self.jpg(10))
+        self.assertNotEquals(current.get()[0], etag)
+        self.assertNotEquals(CurrentFrame().etag(1, None), CurrentFrame().etag(1, None))
+
+    def test_widths_are_resized_once_per_frame(self):
+        current = CurrentFrame()
+        current.update(self.jpg(10))
+        (etag, jpg) = current.get(160)
+        self.assertEquals(cv2.imdecode(numpy.frombuffer(jpg, dtype=numpy.uint8), cv2.IMREAD_COLOR).shape, (120, 160, 3))
+        self.assertTrue(current.get(160)[1] is jpg)
+        self.assertNotEquals(etag, current.get()[0])
+        # Not wider than the frame itself
+        self.assertEquals(current.get(1000), current.get())
+
+        current.update(self.jpg(20))
+        self.assertEquals(current.variants, {})
+
+    def test_cached(self):
+        current = CurrentFrame()
+        current.update(self.jpg(10))
+        self.assertEquals(current.cached(160), None)
+        self.assertEquals(current.cached(160), None)
+        variant = current.get(160)
+        self.assertEquals(current.cached(160), variant)
+        # Widths that don't need resizing are remembered as well
+        current.get(1000)
+        self.assertEquals(current.cached(1000), current.get())
+
+    def test_concurrent_requests_resize_once(self):
+        current = CurrentFrame()
+        current.update(self.jpg(10))
+        resize = current.resize
+        resized = []
+        def slow_resize(*args):
+            resized.append(args[2])
+            time.sleep(0.05)
+            return resize(*args)
+        current.resize = slow_resize
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(current.get(160))) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEquals(resized, [160])
+        self.assertEquals(len(set(results)), 1)
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from downloads import parse_range, send_file, FileRangeProducer
+from helpers import FakeRequest
+
+
+class ParseRangeTests(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEquals(parse_range(None, 100), None)
+        self.assertEquals(parse_range("bytes=10-19", 100), (10, 19))
+        self.assertEquals(parse_range("bytes=90-", 100), (90, 99))
+        self.assertEquals(parse_range("bytes=90-200", 100), (90, 99))
+        self.assertEquals(parse_range("bytes=-10", 100), (90, 99))
+        self.assertEquals(parse_range("bytes=100-", 100), False)
+        self.assertEquals(parse_range("bytes=0-1,5-6", 100), None)
+        self.assertEquals(parse_range("bytes=a-b", 100), None)
+
+
+class SendFileTests(unittest.TestCase):
+    def setUp(self):
+        (handle, self.file_name) = tempfile.mkstemp()
+        self.content = "".join(chr(i % 256) for i in range(200000))
+        with os.fdopen(handle, "wb") as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        os.remove(self.file_name)
+
+    def test_whole_file_in_chunks(self):
+        request = FakeRequest()
+        send_file(request, self.file_name, download_name="pool.avi")
+        self.assertEquals(request.run(), self.content)
+        self.assertTrue(request.done)
+        self.assertEquals(request.code, 200)
+        self.assertEquals(request.headers["Content-Length"], str(len(self.content)))
+        self.assertTrue(max(len(chunk) for chunk in request.written) <= FileRangeProducer.CHUNK_SIZE)
+
+    def test_range(self):
+        request = FakeRequest({"range": "bytes=1000-99999"})
+        send_file(request, self.file_name)
+        self.assertEquals(request.run(), self.content[1000:100000])
+        self.assertEquals(request.code, 206)
+        self.assertEquals(request.headers["Content-Range"], "bytes 1000-99999/200000")
+
+    def test_unsatisfiable_range(self):
+        request = FakeRequest({"range": "bytes=300000-"})
+        send_file(request, self.file_name)
+        self.assertEquals(request.code, 416)
+        self.assertEquals(request.run(), "")
+        self.assertTrue(request.done)
@@ -0,0 +1,57 @@
+import unittest
+import threading
+import time
+import numpy
+import cv2
+
+from encoder import EncoderPool
+
+class EncoderPoolTests(unittest.TestCase):
+    def frame(self, value):
+        return numpy.ones((16, 16, 3), dtype=numpy.uint8) * value
+
+    def test_frames_delivered_in_order(self):
+        delivered = []
+        pool = EncoderPool(lambda jpg_frame, timestamp: delivered.append(timestamp), workers=3, queue_size=100, drop_policy='block')
+        for i in range(50):
+            pool.submit(self.frame(i), timestamp=i)
+        while pool.next_delivery < 50:
+            time.sleep(0.01)
+        pool.stop()
+        self.assertEquals(delivered, range(50))
+
+    def test_drop_oldest(self):
+        delivered = []
+        release = threading.Event()
+        def callback(jpg_frame, timestamp):
+            release.wait()
+            delivered.append(timestamp)
+
+        pool = EncoderPool(callback, workers=1, queue_size=1, drop_policy='oldest')
+        pool.submit(self.frame(0), timestamp=0)
+        while pool.queue:
+            time.sleep(0.01)
+        # The worker is stuck on frame 0, so frame 1 gets queued and then dropped for frame 2
+        pool.submit(self.frame(1), timestamp=1)
+        pool.submit(self.frame(2), timestamp=2)
+        release.set()
+        while pool.next_delivery < 3:
+            time.sleep(0.01)
+        pool.stop()
+        self.assertEquals(delivered, [0, 2])
+        self.assertEquals(pool.dropped_frames, 1)
+
+    def test_inline_encoding(self):
+        delivered = []
+        pool = EncoderPool(lambda jpg_frames, timestamp: delivered.append(jpg_frames), workers=0)
+        pool.submit(self.frame(10))
+        self.assertEquals(len(delivered), 1)
+        self.assertEquals(delivered[0]['archive'][:2].tostring(), "\xff\xd8")
+
+    def test_tiers(self):
+        delivered = []
+        tiers = {'full': (None, 80), 'small': (8, 40), 'small_good': (8, 90)}
+        pool = EncoderPool(lambda jpg_frames, timestamp: delivered.append(jpg_frames), workers=0, tiers=tiers)
+        pool.submit(self.frame(10))
+        shapes = dict((name, cv2.imdecode(jpg_frame, cv2.IMREAD_COLOR).shape) for (name, jpg_frame) in delivered[0].items())
+        self.assertEquals(shapes, {'full': (16, 16, 3), 'small': (8, 8, 3), 'small_good': (8, 8, 3)})
@@ -0,0 +1,29 @@
+import unittest
+import datetime
+
+from eventstore import MotionEventStore, MotionEvent, from_timestamp
+
+class MotionEventStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.store = MotionEventStore(path=None, tail_length=3)
+        # Events from 0-10, 20-30, ..., 80-90 seconds after a fixed start
+        self.base = 1400000000
+        for i in range(5):
+            event = MotionEvent(from_timestamp(self.base + i * 20))
+            self.store.add(event)
+            event.end = from_timestamp(self.base + i * 20 + 10)
+            self.store.finish(event)
+
+    def test_range_from_tail(self):
+        self.assertEquals(self.store.between(self.base + 45, self.base + 85), [(self.base + 40, self.base + 50), (self.base + 60, self.base + 70), (self.base + 80, self.base + 90)])
+        self.assertEquals(self.store.between(self.base + 51, self.base + 59), [])
+
+    def test_range_from_database(self):
+        summary = self.store.summary(self.base + 5, self.base + 25)
+        self.assertEquals(summary['events'], 2)
+        self.assertAlmostEquals(summary['motion_seconds'], 10)
+        self.assertEquals(len(self.store), 5)
+
+    def test_last_event(self):
+        self.assertEquals(self.store.last().end, from_timestamp(self.base + 90))
+        self.assertTrue(isinstance(self.store.last().ago(), datetime.timedelta))
@@ -0,0 +1,155 @@
+import unittest
+import time
+import numpy
+
+from motion import MotionZones, MotionDetector, AnalysisCadence
+
+class MotionZonesTests(unittest.TestCase):
+    def test_zone_scores(self):
+        zones = {
+            'table': {'polygon': [(0, 0), (0.5, 0), (0.5, 1), (0, 1)]},
+            'pocket': {'polygon': [(0, 0), (0.1, 0), (0.1, 0.1), (0, 0.1)]},
+            'doorway': {'polygon': [(0.9, 0), (1, 0), (1, 1), (0.9, 1)], 'ignore': True},
+        }
+        motion_zones = MotionZones(zones, 160, 120)
+        motion_image = numpy.zeros((120, 160), dtype=numpy.uint8)
+        motion_image[5, 5] = 50
+        motion_image[60, 150] = 99
+        # Outside of every zone, doesn't count because there are zones that aren't ignored
+        motion_image[60, 120] = 20
+
+        (overall, zone_scores) = motion_zones.scores(motion_image)
+        self.assertEquals(overall, 50)
+        self.assertEquals(zone_scores, {'table': 50, 'pocket': 50, 'doorway': 99})
+
+    def test_only_ignored_zones(self):
+        motion_zones = MotionZones({'doorway': {'polygon': [(0.5, 0), (1, 0), (1, 1), (0.5, 1)], 'ignore': True}}, 16, 12)
+        motion_image = numpy.zeros((12, 16), dtype=numpy.uint8)
+        motion_image[:, 12] = 200
+        motion_image[3, 2] = 7
+        self.assertEquals(motion_zones.scores(motion_image)[0], 7)
+
+
+class MotionDetectorTests(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.detector = MotionDetector(threshold=2, analysis_size=(160, 120), zones={}, callback=self.events.append, event_db=None)
+        self.still = numpy.full((240, 320, 3), 60, dtype=numpy.uint8)
+        self.moved = self.still.copy()
+        self.moved[100:140, 140:180] = 255
+
+    def test_first_frame(self):
+        self.detector.update(self.still)
+        self.assertEquals(self.detector.motion_avg, None)
+        self.assertEquals(self.detector.measure(self.still), 0)
+
+    def test_still_and_changed_frames(self):
+        self.detector.update(self.still)
+        self.detector.update(self.still)
+        self.assertEquals(self.detector.motion_avg, 0)
+        self.assertFalse(self.detector.motion_detected)
+        self.detector.update(self.moved)
+        self.assertTrue(self.detector.motion_avg > 100)
+        self.assertTrue(self.detector.motion_detected)
+
+    def test_event_starts_and_ends_at_threshold(self):
+        self.detector.update(self.still)
+        self.detector.update(self.moved)
+        self.assertEquals(len(self.events), 1)
+        event = self.events[0]
+        self.assertEquals(event.end, None)
+        self.assertTrue(self.detector.last_event() is event)
+        self.assertTrue(self.detector.recent_motion())
+
+        # The running average catches up with the changed frame until the difference drops below the threshold
+        for i in range(20):
+            self.detector.update(self.moved)
+            if not self.detector.motion_detected:
+                break
+        self.assertFalse(self.detector.motion_detected)
+        self.assertTrue(self.detector.motion_avg < 2)
+        self.assertEquals(self.events, [event, event])
+        self.assertNotEquals(event.end, None)
+
+
+class StillDetector(object):
+    """ Motion detector that only sees motion when told to, counting the frames it's given """
+
+    def __init__(self):
+        self.updates = 0
+        self.moving = False
+
+    def update(self, frame):
+        self.updates += 1
+
+    def recent_motion(self):
+        return self.moving
+
+
+class AnalysisCadenceTests(unittest.TestCase):
+    def setUp(self):
+        self.detector = StillDetector()
+        self.cadence = AnalysisCadence(self.detector, idle_rate=2, idle_after=300, wake_threshold=25, wake_points=3)
+        self.frame = numpy.zeros((64, 64, 3), dtype=numpy.uint8)
+
+    def go_idle(self):
+        self.cadence.last_recent_motion = time.time() - 301
+        self.assertTrue(self.cadence.analyse(self.frame))
+        self.assertEquals(self.cadence.mode, AnalysisCadence.IDLE)
+
+    def changed_frame(self, points, change=30):
+        frame = self.frame.copy()
+        for i in range(points):
+            frame[i * 16, i * 16, 1] = change
+        return frame
+
+    def test_idle_after_no_motion(self):
+        self.assertTrue(self.cadence.analyse(self.frame))
+        self.assertEquals(self.cadence.mode, AnalysisCadence.FULL)
+        self.go_idle()
+
+    def test_idle_rate(self):
+        self.go_idle()
+        self.assertFalse(self.cadence.analyse(self.frame))
+        self.assertEquals(self.cadence.skipped, 1)
+        # Due again once the idle interval of half a second is over
+        self.cadence.last_analysis = time.time() - 0.6
+        self.assertTrue(self.cadence.analyse(self.frame))
+        self.assertEquals(self.detector.updates, 2)
+        self.assertEquals(self.cadence.mode, AnalysisCadence.IDLE)
+
+    def test_wakes_on_grid_change(self):
+        self.go_idle()
+        # Too few changed pixels, or changes below the threshold, don't wake it
+        self.assertFalse(self.cadence.analyse(self.changed_frame(2)))
+        self.assertFalse(self.cadence.analyse(self.frame))
+        self.assertFalse(self.cadence.analyse(self.changed_frame(3, change=20)))
+        self.assertFalse(self.cadence.analyse(self.frame))
+        self.assertTrue(self.cadence.analyse(self.changed_frame(3)))
+        self.assertEquals(self.cadence.mode, AnalysisCadence.FULL)
+        self.assertTrue(self.cadence.analyse(self.frame))
+
+    def test_wakes_on_motion_found_while_idle(self):
+        self.go_idle()
+        self.detector.moving = True
+        self.cadence.last_analysis = time.time() - 0.6
+        self.assertTrue(self.cadence.analyse(self.frame))
+        self.assertEquals(self.cadence.mode, AnalysisCadence.FULL)
+        self.assertTrue(self.cadence.analyse(self.frame))
+
+    def test_grid_check_right_after_idle_analysis(self):
+        self.go_idle()
+        self.assertFalse(self.cadence.analyse(self.frame))
+        self.cadence.last_analysis = time.time() - 0.6
+        self.assertTrue(self.cadence.analyse(self.frame))
+        # Compared to the frame that was just analysed
+        self.assertTrue(self.cadence.analyse(self.changed_frame(3)))
+        self.assertEquals(self.cadence.mode, AnalysisCadence.FULL)
+
+    def test_stats(self):
+        self.go_idle()
+        self.cadence.analyse(self.frame)
+        stats = self.cadence.stats()
+        self.assertEquals(sorted(stats.keys()), ['analysis_fps', 'analysis_ms', 'check_ms', 'mode', 'skipped'])
+        self.assertEquals((stats['mode'], stats['skipped']), (AnalysisCadence.IDLE, 1))
+        self.assertTrue(stats['analysis_ms'] >= 0 and stats['check_ms'] >= 0)
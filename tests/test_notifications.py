@@ -0,0 +1,52 @@
+import json
+import unittest
+
+from notifications import NotificationChannel
+from helpers import FakeRequest
+
+
+class NotificationChannelTests(unittest.TestCase):
+    def setUp(self):
+        self.channel = NotificationChannel()
+
+    def tearDown(self):
+        if self.channel.keepalive.running:
+            self.channel.keepalive.stop()
+        for (request, call) in self.channel.polls:
+            call.cancel()
+
+    def test_only_changes_are_sent(self):
+        request = FakeRequest()
+        self.channel.subscribe(request)
+        self.channel.deliver("motion", {'active': True})
+        self.channel.deliver("motion", {'active': True})
+        self.channel.deliver("motion", {'active': False})
+        events = [x for x in request.written if x.startswith("id:")]
+        self.assertEquals(len(events), 2)
+        self.assertTrue(events[0].startswith("id: 1\nevent: motion\n"))
+        self.assertEquals(json.loads(events[1].split("data: ")[1])['data'], {'active': False})
+
+    def test_reconnecting_gets_missed_events(self):
+        for i in range(3):
+            self.channel.deliver("fps", {'fps': i})
+        request = FakeRequest()
+        self.channel.subscribe(request, last_id=1)
+        self.assertEquals(len([x for x in request.written if x.startswith("id:")]), 2)
+        request.finished.callback(None)
+        self.assertEquals(self.channel.streams, [])
+
+    def test_long_poll(self):
+        self.channel.deliver("lock", {'locked': True})
+        request = FakeRequest()
+        self.channel.poll(request, 0)
+        self.assertTrue(request.done)
+        self.assertEquals(json.loads(request.written[0])[0]['event'], "lock")
+
+        # Waits for the next event
+        request = FakeRequest()
+        self.channel.poll(request, 1)
+        self.assertFalse(request.done)
+        self.channel.deliver("lock", {'locked': False})
+        self.assertTrue(request.done)
+        self.assertEquals(json.loads(request.written[0])[0]['id'], 2)
+        self.assertEquals(self.channel.polls, [])
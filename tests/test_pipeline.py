@@ -0,0 +1,47 @@
+import unittest
+import time
+
+from pipeline import Stage, SourceStage
+
+class PipelineTests(unittest.TestCase):
+    def test_put_drops_oldest_when_full(self):
+        stage = Stage("test", lambda item: item, queue_size=2)
+        for i in range(5):
+            stage.put(i)
+        self.assertEquals([stage.queue.get_nowait(), stage.queue.get_nowait()], [3, 4])
+        self.assertEquals(stage.dropped, 3)
+
+    def test_items_flow_through_stages(self):
+        results = []
+        counter = iter(range(1, 1000))
+        sink = Stage("sink", results.append, queue_size=1000)
+        double = Stage("double", lambda item: item * 2, outputs=[sink], queue_size=1000)
+        source = SourceStage("source", lambda: next(counter) if len(results) < 10 else None, outputs=[double])
+        for stage in [sink, double, source]:
+            stage.start()
+        while len(results) < 10:
+            time.sleep(0.01)
+        for stage in [sink, double, source]:
+            stage.stop()
+            stage.thread.join()
+        self.assertEquals(results[:10], [2, 4, 6, 8, 10, 12, 14, 16, 18, 20])
+        self.assertEquals(double.stats()['dropped'], 0)
+
+    def test_handler_errors(self):
+        (results, failures) = ([], [])
+        def handler(item):
+            if item == 2:
+                raise ValueError("bad item")
+            results.append(item)
+        stage = Stage("test", handler, queue_size=10, on_error=lambda stage, error: failures.append((stage.name, str(error))))
+        stage.start()
+        for i in range(4):
+            stage.put(i)
+        while len(results) < 3:
+            time.sleep(0.01)
+        stage.stop()
+        stage.thread.join()
+        # The stage goes on after a failed item
+        self.assertEquals(results, [0, 1, 3])
+        self.assertEquals(failures, [("test", "bad item")])
+        self.assertEquals(stage.stats()['errors'], 1)
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+import unittest
+import numpy
+import cv2
+
+from ringbuffer import FrameRingBuffer
+from replay import ReplayStream, mjpeg_avi, jpeg_size
+from helpers import FakeRequest
+
+
+def jpg(i, width=160, height=120):
+    frame = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+    frame[:, i % width] = 255
+    return cv2.imencode(".jpg", frame)[1].tostring()
+
+
+class MjpegAviTests(unittest.TestCase):
+    def test_jpeg_size(self):
+        self.assertEquals(jpeg_size(jpg(0, 320, 240)), (320, 240))
+
+    def test_avi_can_be_played(self):
+        frames = [(100 + i * 0.04, jpg(i)) for i in range(20)]
+        (handle, path) = tempfile.mkstemp(suffix=".avi")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                f.write(mjpeg_avi(frames))
+            capture = cv2.VideoCapture(path)
+            self.assertAlmostEquals(capture.get(cv2.CAP_PROP_FPS), 25)
+            count = 0
+            while capture.read()[0]:
+                count += 1
+            self.assertEquals(count, 20)
+        finally:
+            os.remove(path)
+
+
+class ReplayStreamTests(unittest.TestCase):
+    def setUp(self):
+        self.ring_buffer = FrameRingBuffer(100, frame_size=2000)
+        now = time.time()
+        for i in range(50):
+            self.ring_buffer.append(jpg(i), timestamp=now - 5 + i * 0.1)
+
+    def test_starts_seconds_ago(self):
+        request = FakeRequest()
+        stream = ReplayStream(request, self.ring_buffer, 2)
+        stream.send_due()
+        stream.stopProducing()
+        self.assertEquals(len(request.written), 1)
+        self.assertTrue(jpg(30) in request.written[0])
+        # Nothing more is due yet
+        stream.request = request
+        stream.send_due()
+        stream.stopProducing()
+        self.assertEquals(len(request.written), 1)
+
+    def test_not_further_back_than_the_buffer(self):
+        request = FakeRequest()
+        stream = ReplayStream(request, self.ring_buffer, 60)
+        stream.send_due()
+        stream.stopProducing()
+        self.assertTrue(jpg(0) in request.written[0])
@@ -0,0 +1,94 @@
+import unittest
+import tempfile
+import os
+import numpy
+
+from ringbuffer import FrameRingBuffer
+
+class RingBufferTests(unittest.TestCase):
+    def frames(self, ring_buffer):
+        return [frame.tostring() for frame in ring_buffer]
+
+    def test_ordered_iteration(self):
+        ring_buffer = FrameRingBuffer(3, frame_size=10)
+        for frame in ["a", "bb", "ccc", "dddd"]:
+            ring_buffer.append(frame)
+        self.assertEquals(self.frames(ring_buffer), ["bb", "ccc", "dddd"])
+        self.assertEquals(ring_buffer.newest().tostring(), "dddd")
+
+    def test_wraps_and_evicts_by_size(self):
+        ring_buffer = FrameRingBuffer(4, frame_size=3)
+        ring_buffer.append("aaaa")
+        ring_buffer.append("bbbb")
+        ring_buffer.append("cccc")
+        # Doesn't fit at the end of the 12 bytes, is written at the start and overwrites the oldest frame
+        ring_buffer.append("dd")
+        self.assertEquals(self.frames(ring_buffer), ["bbbb", "cccc", "dd"])
+        ring_buffer.append("eeeeeeee")
+        self.assertEquals(self.frames(ring_buffer), ["dd", "eeeeeeee"])
+
+    def test_accepts_encoded_arrays(self):
+        ring_buffer = FrameRingBuffer(2, frame_size=10)
+        ring_buffer.append(numpy.array([[1], [2], [3]], dtype=numpy.uint8), timestamp=5.0)
+        self.assertEquals(self.frames(ring_buffer), ["\x01\x02\x03"])
+        self.assertEquals(ring_buffer.timestamps[0], 5.0)
+
+    def test_frame_too_large(self):
+        ring_buffer = FrameRingBuffer(2, frame_size=2)
+        self.assertRaises(ValueError, ring_buffer.append, "12345")
+
+    def test_time_range(self):
+        ring_buffer = FrameRingBuffer(10, frame_size=10)
+        for i in range(5):
+            ring_buffer.append(str(i), timestamp=float(i))
+        self.assertEquals([frame.tostring() for frame in ring_buffer.between(1.0, 3.0)], ["1", "2", "3"])
+        self.assertEquals([frame.tostring() for frame in ring_buffer.between(start_time=3.5)], ["4"])
+
+    def test_first_timestamp(self):
+        ring_buffer = FrameRingBuffer(3, frame_size=10)
+        self.assertEquals(ring_buffer.first_timestamp(), None)
+        for i in range(5):
+            ring_buffer.append(str(i), timestamp=i)
+        self.assertEquals(ring_buffer.first_timestamp(), 2)
+        self.assertEquals(ring_buffer.first_timestamp(2.5), 3)
+        self.assertEquals(ring_buffer.first_timestamp(5), None)
+
+    def test_memory_mapped(self):
+        (handle, path) = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            ring_buffer = FrameRingBuffer(3, frame_size=4, path=path)
+            for frame in ["aaaa", "bbbb", "cccc", "dddd"]:
+                ring_buffer.append(frame)
+            self.assertEquals(self.frames(ring_buffer), ["bbbb", "cccc", "dddd"])
+            self.assertEquals(os.path.getsize(path), 4 * 3 * 8 + 12)
+        finally:
+            os.remove(path)
+
+    def test_snapshot(self):
+        ring_buffer = FrameRingBuffer(4, frame_size=2)
+        for frame in ["a", "b", "c", "d"]:
+            ring_buffer.append(frame, timestamp=float(ord(frame)))
+        snapshot = ring_buffer.snapshot()
+
+        frames = []
+        for frame in snapshot:
+            frames.append(frame.tostring())
+            if frame.tostring() == "b":
+                # Overwrites "a" and "b" while "b" is being read
+                ring_buffer.append("xxxxxx")
+        ring_buffer.append("yyyyyyyy")
+
+        self.assertEquals(frames, ["a", "b"])
+        report = snapshot.report()
+        self.assertEquals((report['frames'], report['first_sequence'], report['last_sequence']), (1, 0, 0))
+        self.assertEquals((report['torn'], report['skipped']), (1, 2))
+
+    def test_snapshot_sample(self):
+        ring_buffer = FrameRingBuffer(10, frame_size=2)
+        for i in range(10):
+            ring_buffer.append(str(i), timestamp=float(i))
+        snapshot = ring_buffer.snapshot()
+        self.assertEquals(snapshot.sample(4), [(0.0, "0"), (3.0, "3"), (6.0, "6"), (9.0, "9")])
+        self.assertEquals(len(snapshot.sample(20)), 10)
+        self.assertEquals(snapshot.report()['frames'], 0)
@@ -0,0 +1,122 @@
+import unittest
+import threading
+import time
+
+from scheduler import EncodeScheduler, EncodeJob
+
+class EncodeSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.transcode_release = threading.Event()
+        self.ran = []
+        self.kinds = []
+        self.scheduler = EncodeScheduler(self.run_job, max_jobs=1)
+
+    def run_job(self, job):
+        if job.kind == EncodeJob.TRANSCODE:
+            self.kinds.append(job.kind)
+            self.transcode_release.wait()
+            return job.source_file
+        self.release.wait()
+        self.kinds.append(job.kind)
+        self.ran.append((job.start_time, job.end_time))
+        return "video-%s" % job.id
+
+    def wait_for_jobs(self, count):
+        jobs = []
+        while len(jobs) < count:
+            jobs += self.scheduler.finished_jobs()
+            time.sleep(0.01)
+        return jobs
+
+    def test_merges_overlapping_saves(self):
+        running = self.scheduler.save(0, 30)
+        # Covered by the running job
+        self.assertTrue(self.scheduler.save(2, 28) is running)
+        # Reaches past the running job, queued, and the next overlapping save merges into that
+        queued = self.scheduler.save(10, 40)
+        self.assertFalse(queued is running)
+        self.assertTrue(self.scheduler.save(15, 45) is queued)
+        self.assertEquals(queued.requests, 2)
+
+        self.release.set()
+        jobs = self.wait_for_jobs(2)
+        self.assertEquals(self.ran, [(0, 30), (10, 45)])
+        self.assertEquals([job.output_file for job in jobs], ["video-%s" % running.id, "video-%s" % queued.id])
+        self.assertFalse(self.scheduler.busy())
+
+    def test_separate_saves(self):
+        self.release.set()
+        self.scheduler.save(0, 10)
+        self.scheduler.save(100, 110)
+        self.wait_for_jobs(2)
+        self.assertEquals(self.ran, [(0, 10), (100, 110)])
+
+    def test_save_ending_after_running_job_keeps_its_tail(self):
+        running = self.scheduler.save(0, 30)
+        # Overlaps the running job but ends a second after it
+        later = self.scheduler.save(20, 31)
+        self.assertFalse(later is running)
+        self.assertEquals(running.requests, 1)
+
+        self.release.set()
+        self.wait_for_jobs(2)
+        self.assertEquals(self.ran, [(0, 30), (20, 31)])
+
+    def test_transcode(self):
+        self.transcode_release.set()
+        job = self.scheduler.transcode("video.avi")
+        self.assertEquals(job.kind, EncodeJob.TRANSCODE)
+        (finished,) = self.wait_for_jobs(1)
+        self.assertTrue(finished is job)
+        self.assertEquals(finished.output_file, "video.avi")
+        self.assertEquals(self.kinds, [EncodeJob.TRANSCODE])
+
+    def test_save_runs_during_transcode(self):
+        self.scheduler.transcode("video.avi")
+        self.assertTrue(self.scheduler.busy(EncodeJob.TRANSCODE))
+        # The transcode doesn't take the save's slot
+        save = self.scheduler.save(0, 10)
+        self.assertTrue(save in self.scheduler.running)
+        self.release.set()
+        self.assertTrue(self.wait_for_jobs(1)[0] is save)
+        self.transcode_release.set()
+        self.wait_for_jobs(1)
+
+    def test_saves_run_before_queued_transcodes(self):
+        self.transcode_release.set()
+        first = self.scheduler.save(0, 10)
+        second = self.scheduler.save(100, 110)
+        transcode = self.scheduler.transcode("video.avi")
+        # There's a free transcode slot, but a save is waiting
+        self.assertEquals(self.scheduler.queued, [second, transcode])
+        self.release.set()
+        self.wait_for_jobs(3)
+        self.assertEquals(self.ran, [(0, 10), (100, 110)])
+        self.assertEquals(sorted(self.kinds), [EncodeJob.SAVE, EncodeJob.SAVE, EncodeJob.TRANSCODE])
+
+    def test_snapshot_taken_when_requested(self):
+        windows = []
+        def snapshot(start_time, end_time):
+            windows.append((start_time, end_time))
+            return "snapshot-%s" % len(windows)
+        self.scheduler = EncodeScheduler(self.run_job, max_jobs=1, snapshot=snapshot)
+        running = self.scheduler.save(0, 30)
+        self.assertEquals(running.snapshot, "snapshot-1")
+        # A queued job gets a new snapshot when a save is merged into it
+        queued = self.scheduler.save(20, 40)
+        self.scheduler.save(35, 50)
+        self.assertEquals(queued.snapshot, "snapshot-3")
+        self.assertEquals(windows, [(0, 30), (20, 40), (20, 50)])
+        self.release.set()
+        self.wait_for_jobs(2)
+
+    def test_saves_in_the_same_second_get_separate_files(self):
+        self.release.set()
+        first = self.scheduler.save(0, 10)
+        second = self.scheduler.save(5, 11)
+        second.created = first.created
+        self.assertFalse(first is second)
+        self.assertNotEquals(first.file_name(), second.file_name())
+        self.assertTrue(first.file_name().startswith("pool-") and first.file_name().endswith(".avi"))
+        self.wait_for_jobs(2)
@@ -0,0 +1,91 @@
+import unittest
+import shutil
+import tempfile
+import threading
+import time
+import os
+
+from segments import Segment, SegmentEncoder
+
+
+class FinishedProcess(object):
+    """ Stands in for an ffmpeg process that already exited """
+
+    def __init__(self, returncode=0):
+        self.returncode = returncode
+
+    def wait(self):
+        return self.returncode
+
+
+class SegmentEncoderTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.encoder = SegmentEncoder(lambda: 25, directory=self.directory, segment_seconds=2, max_segments=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def finish(self, start_time, returncode=0):
+        """ A segment from start_time to start_time + 2, as if its ffmpeg process just exited """
+        segment = Segment(os.path.join(self.directory, "segment-%s.ts" % start_time), start_time)
+        segment.end_time = start_time + 2
+        segment.process = FinishedProcess(returncode)
+        open(segment.path, "w").close()
+        self.encoder.wait_for_segment(segment)
+        return segment
+
+    def start_times(self, segments):
+        return [segment.start_time for segment in segments]
+
+    def test_segments_ordered_by_start_time(self):
+        for start_time in [0, 4, 2, 6]:
+            self.finish(start_time)
+        self.assertEquals(self.start_times(self.encoder.segments), [2, 4, 6])
+
+    def test_failed_segment_removed(self):
+        segment = self.finish(0, returncode=1)
+        self.assertEquals(self.encoder.segments, [])
+        self.assertFalse(os.path.exists(segment.path))
+
+    def test_acquire_and_release(self):
+        for start_time in [0, 2, 4]:
+            self.finish(start_time)
+        segments = self.encoder.acquire(1, 3)
+        self.assertEquals(self.start_times(segments), [0, 2])
+        self.assertEquals([segment.in_use for segment in segments], [1, 1])
+        self.encoder.release(segments)
+        self.assertEquals([segment.in_use for segment in segments], [0, 0])
+
+    def test_expired_segment_kept_while_in_use(self):
+        oldest = self.finish(0)
+        for start_time in [2, 4]:
+            self.finish(start_time)
+        segments = self.encoder.acquire(0, 1)
+        self.finish(6)
+        self.assertTrue(oldest.expired)
+        self.assertTrue(os.path.exists(oldest.path))
+        self.encoder.release(segments)
+        self.assertFalse(os.path.exists(oldest.path))
+
+    def test_expired_segment_removed(self):
+        oldest = self.finish(0)
+        for start_time in [2, 4, 6]:
+            self.finish(start_time)
+        self.assertFalse(os.path.exists(oldest.path))
+
+    def test_wait_for(self):
+        self.finish(0)
+        t = threading.Timer(0.2, self.finish, (2,))
+        t.start()
+        started = time.time()
+        self.encoder.wait_for(3, timeout=5)
+        self.assertTrue(time.time() - started < 4)
+        self.assertEquals(self.start_times(self.encoder.segments), [0, 2])
+        t.join()
+
+    def test_wait_for_times_out(self):
+        self.finish(0)
+        started = time.time()
+        self.encoder.wait_for(10, timeout=0.3)
+        self.assertTrue(0.2 < time.time() - started < 2)
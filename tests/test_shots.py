@@ -0,0 +1,37 @@
+import unittest
+
+from shots import ShotDetector
+
+
+class ShotDetectorTests(unittest.TestCase):
+    def play(self, detector, moving_periods, until):
+        """ Feed the detector 10 frames a second, moving during the given (start, end) periods """
+        for i in range(int(until * 10)):
+            timestamp = i / 10.0
+            detector.update(any(start <= timestamp < end for (start, end) in moving_periods), timestamp)
+
+    def test_shots_end_after_rest(self):
+        detector = ShotDetector(rest_seconds=1)
+        self.play(detector, [(1, 3), (3.5, 4), (6, 7)], 10)
+        # The short pause at 3 isn't long enough to end the first shot
+        self.assertEquals([(shot['start_time'], shot['end_time']) for shot in detector.index()], [(1, 3.9), (6, 6.9)])
+
+    def test_last_shots(self):
+        detector = ShotDetector(rest_seconds=1)
+        self.play(detector, [(1, 2), (4, 5), (7, 8)], 10)
+        (start, end) = detector.last_shots(2, 10)
+        self.assertAlmostEqual(start, 4 - 1)
+        self.assertAlmostEqual(end, 7.9 + 1)
+        self.assertEquals(ShotDetector().last_shots(1, 10), None)
+
+    def test_ongoing_shot_ends_now(self):
+        detector = ShotDetector(rest_seconds=1)
+        self.play(detector, [(1, 2), (4, 10)], 10)
+        self.assertEquals(detector.index()[-1]['end_time'], None)
+        self.assertEquals(detector.last_shots(1, 10)[1], 10)
+
+    def test_index_is_bounded(self):
+        detector = ShotDetector(rest_seconds=0.5, index_length=3)
+        self.play(detector, [(i, i + 0.5) for i in range(10)], 11)
+        self.assertEquals(len(detector.index()), 3)
+        self.assertEquals(detector.index()[0]['start_time'], 7)
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import cv2
+
+from thumbnails import ThumbnailCache
+
+
+class ThumbnailCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def samples(self, count):
+        frame = numpy.zeros((480, 640, 3), dtype=numpy.uint8)
+        return [(i, cv2.imencode(".jpg", frame)[1].tostring()) for i in range(count)]
+
+    def test_poster_and_strip(self):
+        cache = ThumbnailCache(self.directory, max_bytes=10 ** 6, width=80)
+        cache.add("pool-1.avi", self.samples(5))
+        poster = cv2.imdecode(numpy.frombuffer(cache.get("pool-1.avi", "poster"), dtype=numpy.uint8), cv2.IMREAD_COLOR)
+        strip = cv2.imdecode(numpy.frombuffer(cache.get("pool-1.avi", "strip"), dtype=numpy.uint8), cv2.IMREAD_COLOR)
+        self.assertEquals(poster.shape, (60, 80, 3))
+        self.assertEquals(strip.shape, (60, 400, 3))
+        self.assertEquals(cache.get("pool-2.avi", "poster"), None)
+
+    def test_least_recently_used_are_evicted(self):
+        cache = ThumbnailCache(self.directory, max_bytes=10 ** 6, width=80)
+        for i in range(3):
+            cache.add("pool-%s.avi" % i, self.samples(1))
+        # Room for two recordings' thumbnails, and pool-0 was used last
+        cache.max_bytes = cache.total_bytes * 2 / 3
+        cache.get("pool-0.avi", "poster")
+        cache.get("pool-0.avi", "strip")
+        cache.add("pool-3.avi", self.samples(1))
+
+        self.assertEquals(cache.get("pool-1.avi", "poster"), None)
+        self.assertEquals(cache.get("pool-2.avi", "poster"), None)
+        self.assertNotEquals(cache.get("pool-0.avi", "poster"), None)
+        self.assertEquals(sorted(os.listdir(self.directory)), sorted(cache.entries.keys()))
+        self.assertEquals(ThumbnailCache(self.directory).total_bytes, cache.total_bytes)
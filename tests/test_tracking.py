@@ -0,0 +1,32 @@
+import unittest
+import numpy
+import cv2
+
+from tracking import BallTracker
+
+class BallTrackerTests(unittest.TestCase):
+    def frame(self, i):
+        frame = numpy.zeros((480, 640, 3), dtype=numpy.uint8)
+        frame[:] = (40, 120, 30)
+        # One ball rolling right at 250 pixels per second, one lying still
+        cv2.circle(frame, (100 + i * 10, 240), 10, (255, 255, 255), -1)
+        cv2.circle(frame, (400, 100), 10, (0, 0, 200), -1)
+        return frame
+
+    def test_tracks_balls(self):
+        tracker = BallTracker(table_polygon=[(0.05, 0.05), (0.95, 0.05), (0.95, 0.95), (0.05, 0.95)], budget_ms=1000)
+        for i in range(20):
+            tracker.update(self.frame(i), timestamp=i * 0.04)
+
+        balls = sorted(tracker.history[-1][1], key=lambda ball: ball['id'])
+        self.assertEquals([ball['id'] for ball in balls], [1, 2])
+        self.assertAlmostEquals(balls[0]['x'], 290 / 640.0, places=2)
+        self.assertAlmostEquals(balls[0]['vx'], 250 / 640.0, places=1)
+        self.assertAlmostEquals(balls[1]['vx'], 0)
+        self.assertEquals(len(tracker.between(start_time=0.5)), 7)
+
+    def test_skips_frames_over_budget(self):
+        tracker = BallTracker(budget_ms=0.001)
+        self.assertTrue(tracker.update(self.frame(0)))
+        self.assertFalse(tracker.update(self.frame(1)))
+        self.assertEquals(tracker.skipped_frames, 1)
@@ -0,0 +1,82 @@
+import collections
+import threading
+import os
+import cv2
+import numpy
+
+import settings
+
+KINDS = ('poster', 'strip')
+
+
+class ThumbnailCache(object):
+    """ A poster frame and a strip of preview frames for every saved recording.
+
+        They are made when a recording is saved, from a few of the jpgs in the replay buffer, so the video itself
+        is never decoded. Kept on disk, and when they take up more than max_bytes the least recently used are removed.
+    """
+
+    def __init__(self, directory=settings.THUMBNAIL_DIRECTORY, max_bytes=settings.THUMBNAIL_CACHE_BYTES,
+                 width=settings.THUMBNAIL_WIDTH):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.width = width
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # File name -> size, least recently used first. Uses touch the file, so the order survives restarts.
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        paths = [os.path.join(directory, x) for x in os.listdir(directory)]
+        for path in sorted(paths, key=os.path.getmtime):
+            self.entries[os.path.basename(path)] = os.path.getsize(path)
+            self.total_bytes += self.entries[os.path.basename(path)]
+
+    def file_name(self, recording, kind):
+        return "%s.%s.jpg" % (recording, kind)
+
+    def scale(self, jpg):
+        image = cv2.imdecode(numpy.frombuffer(jpg, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        (height, width) = image.shape[:2]
+        return cv2.resize(image, (self.width, max(1, height * self.width / width)), interpolation=cv2.INTER_AREA)
+
+    def add(self, recording, samples):
+        """ Make the thumbnails for a recording from (timestamp, jpg) samples of its frames """
+        images = [image for image in (self.scale(jpg) for (timestamp, jpg) in samples) if image is not None]
+        if not images:
+            return
+        # Every frame comes from the same camera, but make sure the strip lines up anyway
+        height = images[0].shape[0]
+        images = [image if image.shape[0] == height else cv2.resize(image, (self.width, height)) for image in images]
+
+        self.store(self.file_name(recording, 'poster'), cv2.imencode(".jpg", images[len(images) / 2])[1].tostring())
+        self.store(self.file_name(recording, 'strip'), cv2.imencode(".jpg", numpy.hstack(images))[1].tostring())
+
+    def store(self, file_name, content):
+        with open(os.path.join(self.directory, file_name), "wb") as f:
+            f.write(content)
+        with self.lock:
+            self.total_bytes -= self.entries.pop(file_name, 0)
+            self.entries[file_name] = len(content)
+            self.total_bytes += len(content)
+            # Never evicts what was just stored
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                (old_file_name, size) = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                os.remove(os.path.join(self.directory, old_file_name))
+
+    def get(self, recording, kind):
+        """ The thumbnail's jpg, or None if there isn't one (any more) """
+        file_name = self.file_name(recording, kind)
+        path = os.path.join(self.directory, file_name)
+        with self.lock:
+            if file_name not in self.entries:
+                return None
+            self.entries[file_name] = self.entries.pop(file_name)
+            os.utime(path, None)
+            with open(path, "rb") as f:
+                return f.read()
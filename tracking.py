@@ -0,0 +1,181 @@
+import collections
+import itertools
+import math
+import time
+import json
+import os
+import cv2
+import numpy
+
+import settings
+
+
+class BallTrack(object):
+    """ One ball, followed with an alpha-beta filter: predict from the velocity, correct towards each detection. """
+    ALPHA = 0.85
+    BETA = 0.4
+
+    def __init__(self, track_id, x, y, radius, timestamp):
+        self.id = track_id
+        self.x = x
+        self.y = y
+        self.vx = 0.0
+        self.vy = 0.0
+        self.radius = radius
+        self.timestamp = timestamp
+        self.misses = 0
+
+    def predict(self, timestamp):
+        dt = timestamp - self.timestamp
+        return (self.x + self.vx * dt, self.y + self.vy * dt)
+
+    def correct(self, x, y, radius, timestamp):
+        dt = max(timestamp - self.timestamp, 1e-3)
+        (px, py) = self.predict(timestamp)
+        (rx, ry) = (x - px, y - py)
+        self.x = px + self.ALPHA * rx
+        self.y = py + self.ALPHA * ry
+        self.vx += self.BETA / dt * rx
+        self.vy += self.BETA / dt * ry
+        self.radius = radius
+        self.timestamp = timestamp
+        self.misses = 0
+
+    def speed(self):
+        return math.hypot(self.vx, self.vy)
+
+    def state(self):
+        """ Position and velocity relative to the frame size, so they don't depend on the analysis resolution """
+        return {'id': self.id, 'x': self.x, 'y': self.y, 'vx': self.vx, 'vy': self.vy, 'radius': self.radius}
+
+
+class BallTracker(object):
+    """ Finds balls on the table by colour and tracks them from frame to frame.
+
+        Works on a scaled down frame: everything on the table that's far enough from the cloth colour is a ball
+        candidate, and roughly round blobs of the right size are balls. Detections are matched to the nearest
+        predicted track. When a frame takes longer than the time budget, the following frames are skipped
+        to make up for it. Tracked positions are kept for as long as the replay buffer lasts.
+    """
+
+    def __init__(self, table_polygon=settings.TABLE_POLYGON, analysis_size=settings.TRACKING_ANALYSIS_SIZE,
+                 budget_ms=settings.TRACKING_BUDGET_MS, history_seconds=settings.TRACKING_HISTORY_SECONDS):
+        (width, height) = self.analysis_size = analysis_size
+        self.budget = budget_ms / 1000.0
+        self.history_seconds = history_seconds
+
+        self.table_mask = numpy.zeros((height, width), dtype=numpy.uint8)
+        if table_polygon:
+            polygon = numpy.array([(x * (width - 1), y * (height - 1)) for (x, y) in table_polygon], dtype=numpy.int32)
+            cv2.fillPoly(self.table_mask, [polygon], 255)
+        else:
+            self.table_mask[:] = 255
+
+        # Reused for every frame
+        self.small_frame = numpy.empty((height, width, 3), dtype=numpy.uint8)
+        self.cloth = numpy.empty((height, width, 3), dtype=numpy.uint8)
+        self.difference = numpy.empty((height, width, 3), dtype=numpy.uint8)
+        self.grey_difference = numpy.empty((height, width), dtype=numpy.uint8)
+        self.mask = numpy.empty((height, width), dtype=numpy.uint8)
+        self.kernel = numpy.ones((3, 3), dtype=numpy.uint8)
+
+        self.frames_since_cloth_update = None
+        self.tracks = []
+        self.track_ids = itertools.count(1)
+        # (timestamp, [track states]) for every tracked frame, oldest first
+        self.history = collections.deque()
+
+        self.frames_to_skip = 0
+        self.skipped_frames = 0
+        self.last_duration = 0.0
+
+    def update_cloth_colour(self):
+        """ The cloth is whatever colour most of the table is """
+        table_pixels = self.small_frame[self.table_mask > 0]
+        if len(table_pixels):
+            self.cloth[:] = numpy.median(table_pixels, axis=0).astype(numpy.uint8)
+        self.frames_since_cloth_update = 0
+
+    def detect(self):
+        """ Circles (x, y, radius) in analysis frame pixels """
+        cv2.absdiff(self.small_frame, self.cloth, self.difference)
+        cv2.cvtColor(self.difference, cv2.COLOR_BGR2GRAY, self.grey_difference)
+        cv2.threshold(self.grey_difference, settings.TRACKING_COLOUR_THRESHOLD, 255, cv2.THRESH_BINARY, self.mask)
+        cv2.bitwise_and(self.mask, self.table_mask, self.mask)
+        cv2.morphologyEx(self.mask, cv2.MORPH_OPEN, self.kernel, self.mask)
+
+        (min_radius, max_radius) = settings.TRACKING_BALL_RADIUS
+        # findContours returns two or three values depending on the opencv version
+        contours = cv2.findContours(self.mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        circles = []
+        for contour in contours:
+            ((x, y), radius) = cv2.minEnclosingCircle(contour)
+            if not min_radius <= radius <= max_radius:
+                continue
+            # Round enough to be a ball and not a cue or an arm
+            if cv2.contourArea(contour) < 0.5 * math.pi * radius * radius:
+                continue
+            circles.append((x, y, radius))
+        return circles
+
+    def match(self, circles, timestamp):
+        (width, height) = self.analysis_size
+        unmatched = [(x / width, y / height, radius / width) for (x, y, radius) in circles]
+        max_distance = settings.TRACKING_MAX_DISTANCE
+
+        for track in sorted(self.tracks, key=lambda track: track.misses):
+            if not unmatched:
+                track.misses += 1
+                continue
+            (px, py) = track.predict(timestamp)
+            closest = min(unmatched, key=lambda circle: math.hypot(circle[0] - px, circle[1] - py))
+            if math.hypot(closest[0] - px, closest[1] - py) <= max_distance:
+                unmatched.remove(closest)
+                track.correct(closest[0], closest[1], closest[2], timestamp)
+            else:
+                track.misses += 1
+
+        self.tracks = [track for track in self.tracks if track.misses <= settings.TRACKING_MAX_MISSES]
+        for (x, y, radius) in unmatched:
+            self.tracks.append(BallTrack(next(self.track_ids), x, y, radius, timestamp))
+
+    def update(self, frame, timestamp=None):
+        """ Track balls in a BGR frame, unless frames are being skipped to stay within the budget """
+        if self.frames_to_skip:
+            self.frames_to_skip -= 1
+            self.skipped_frames += 1
+            return False
+
+        started = time.time()
+        timestamp = timestamp if timestamp is not None else started
+        (width, height) = self.analysis_size
+        cv2.resize(frame, (width, height), self.small_frame, interpolation=cv2.INTER_AREA)
+        if self.frames_since_cloth_update is None or self.frames_since_cloth_update >= settings.TRACKING_CLOTH_INTERVAL:
+            self.update_cloth_colour()
+        self.frames_since_cloth_update += 1
+
+        self.match(self.detect(), timestamp)
+        self.history.append((timestamp, [track.state() for track in self.tracks if not track.misses]))
+        while self.history and self.history[0][0] < timestamp - self.history_seconds:
+            self.history.popleft()
+
+        self.last_duration = time.time() - started
+        if self.last_duration > self.budget:
+            self.frames_to_skip = int(self.last_duration / self.budget)
+        return True
+
+    def moving(self, min_speed):
+        """ Is any ball currently on the table faster than min_speed (frame widths per second) """
+        return any(track.speed() > min_speed for track in self.tracks if not track.misses)
+
+    def between(self, start_time=None, end_time=None):
+        return [(timestamp, states) for (timestamp, states) in list(self.history)
+                if (start_time is None or timestamp >= start_time) and (end_time is None or timestamp <= end_time)]
+
+    def export(self, file_name, start_time=None, end_time=None):
+        """ Write the tracks between start_time and end_time to a json file, to go with a saved clip """
+        directory = os.path.dirname(file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(file_name, "w") as f:
+            json.dump([{'timestamp': timestamp, 'balls': states} for (timestamp, states) in self.between(start_time, end_time)], f)